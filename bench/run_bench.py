@@ -0,0 +1,265 @@
+"""
+离线基准测试：在本地模拟服务上运行 xiaohongshu_mcp 的工具，统计延迟、吞吐量和浏览器往返次数
+
+用法:
+    python bench/run_bench.py                       # 默认并发 1,4,8，每档每个工具 8 次调用
+    python bench/run_bench.py --concurrency 1,2,4 --calls 16 --json report.json
+    python bench/run_bench.py --no-capture          # 关闭接口捕获，只走DOM解析路径
+
+所有请求都发往本地模拟服务（bench/stub_server.py），不会访问小红书，也不需要登录。
+xiaohongshu_mcp 在导入时读取环境变量，因此必须先启动模拟服务、设置环境变量再导入。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from stub_server import StubConfig, StubServer, note_content, note_title  # noqa: E402
+
+BENCH_TOOLS = ["search_notes", "get_note_content", "get_note_comments", "post_comment"]
+SEARCH_LIMIT = 30
+
+
+class RoundTripCounter:
+    """统计 Python 与浏览器之间的协议消息数（每条消息即一次往返）
+
+    通过包装 Playwright 内部的 Channel.send 实现，内部接口在不同版本间可能变化，
+    找不到时只统计延迟，不影响其他指标。
+    """
+
+    def __init__(self, tool_var):
+        self.tool_var = tool_var
+        self.counts: Counter = Counter()
+        self.enabled = False
+
+    def install(self) -> None:
+        try:
+            from playwright._impl._connection import Channel
+        except ImportError:
+            print("未找到 Playwright 内部 Channel 类，跳过往返次数统计")
+            return
+        for name in ("send", "send_return_as_dict", "send_no_reply"):
+            original = getattr(Channel, name, None)
+            if original is None:
+                continue
+            setattr(Channel, name, self._wrap(original))
+        self.enabled = True
+
+    def _wrap(self, original: Callable) -> Callable:
+        counter = self
+
+        def wrapper(channel, method, *args, **kwargs):
+            tool = counter.tool_var.get()
+            if tool:
+                counter.counts[tool] += 1
+            return original(channel, method, *args, **kwargs)
+        return wrapper
+
+    def take(self, tool: str) -> int:
+        return self.counts.pop(tool, 0)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def check_result(tool: str, result: Any, expected: Dict[str, Any]) -> bool:
+    """核对工具返回的结构化结果与模拟服务生成的数据是否一致"""
+    if not isinstance(result, dict):
+        return False
+    if tool == "search_notes":
+        hits = result.get("notes") or []
+        urls = [hit.get("url") for hit in hits]
+        return len(hits) == expected["limit"] and len(set(urls)) == len(urls)
+    if tool == "get_note_content":
+        return (result.get("title") == expected["title"]
+                and result.get("content", "").startswith(expected["content_prefix"]))
+    if tool == "get_note_comments":
+        comments = result.get("comments") or []
+        ids = [comment.get("comment_id") for comment in comments]
+        return len(comments) >= expected["min_comments"] and len(set(ids)) == len(ids)
+    return False
+
+
+class BenchRunner:
+    def __init__(self, mcp_module, server: StubServer, rtt: RoundTripCounter, calls: int):
+        self.m = mcp_module
+        self.server = server
+        self.rtt = rtt
+        self.calls = calls
+        self.sequence = 0
+
+    def _tool(self, name: str) -> Callable:
+        tool = getattr(self.m, name)
+        return getattr(tool, "fn", tool)
+
+    def _next_note_id(self) -> str:
+        # 每次调用使用不同的笔记ID，避免命中缓存和请求合并
+        self.sequence += 1
+        return f"bench{self.sequence:06d}"
+
+    def _call(self, tool: str):
+        base_url = self.server.base_url
+        config = self.server.state.config
+        fn = self._tool(tool)
+        if tool == "search_notes":
+            keyword = f"基准{self._next_note_id()}"
+            return fn(keyword, limit=SEARCH_LIMIT, use_cache=False, output_format="json"), \
+                {"limit": min(SEARCH_LIMIT, config.search_total)}
+        note_id = self._next_note_id()
+        url = f"{base_url}/explore/{note_id}"
+        if tool == "get_note_content":
+            return fn(url, use_cache=False, output_format="json"), \
+                {"title": note_title(note_id), "content_prefix": note_content(note_id)[:20]}
+        if tool == "get_note_comments":
+            return fn(url, use_cache=False, target_count=config.comments_per_note, output_format="json"), \
+                {"min_comments": config.comments_per_note}
+        text = f"基准测试评论 {note_id}"
+        return fn(url, text), {"note_id": note_id, "text": text}
+
+    async def _timed_call(self, tool: str) -> Dict[str, Any]:
+        coro, expected = self._call(tool)
+        started = time.perf_counter()
+        try:
+            result = await coro
+            error = None
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+        elapsed = time.perf_counter() - started
+        if tool == "post_comment":
+            posted = self.server.state.snapshot()["posted"].get(expected["note_id"], [])
+            ok = expected["text"] in posted
+        else:
+            ok = check_result(tool, result, expected)
+        return {"elapsed": elapsed, "ok": ok and error is None, "error": error}
+
+    async def run_level(self, tool: str, concurrency: int) -> Dict[str, Any]:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one() -> Dict[str, Any]:
+            async with semaphore:
+                return await self._timed_call(tool)
+
+        self.rtt.take(tool)
+        started = time.perf_counter()
+        samples = await asyncio.gather(*(one() for _ in range(self.calls)))
+        wall = time.perf_counter() - started
+        latencies = [sample["elapsed"] for sample in samples]
+        errors = [sample["error"] for sample in samples if sample["error"]]
+        return {
+            "tool": tool,
+            "concurrency": concurrency,
+            "calls": self.calls,
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "mean": statistics.mean(latencies),
+            "throughput": self.calls / wall if wall > 0 else 0.0,
+            "round_trips_per_call": self.rtt.take(tool) / self.calls if self.rtt.enabled else None,
+            "correct": sum(1 for sample in samples if sample["ok"]),
+            "errors": errors[:3],
+        }
+
+
+def print_table(rows: List[Dict[str, Any]]) -> None:
+    header = f"{'工具':<20}{'并发':>6}{'p50(s)':>10}{'p95(s)':>10}{'平均(s)':>10}{'吞吐(次/s)':>12}{'往返/次':>10}{'正确':>8}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        rtt = "-" if row["round_trips_per_call"] is None else f"{row['round_trips_per_call']:.1f}"
+        print(f"{row['tool']:<20}{row['concurrency']:>6}{row['p50']:>10.3f}{row['p95']:>10.3f}{row['mean']:>10.3f}"
+              f"{row['throughput']:>12.2f}{rtt:>10}{row['correct']:>5}/{row['calls']:<3}")
+        for error in row["errors"]:
+            print(f"    错误: {error}")
+
+
+async def run(args, server: StubServer) -> Dict[str, Any]:
+    import xiaohongshu_mcp as m
+
+    rtt = RoundTripCounter(m.current_tool)
+    rtt.install()
+    runner = BenchRunner(m, server, rtt, args.calls)
+    tools = [tool.strip() for tool in args.tools.split(",") if tool.strip()]
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    try:
+        login_result = await m.ensure_browser()
+        if not login_result:
+            raise RuntimeError("模拟服务未返回登录cookie，无法开始测试")
+        # 预热：浏览器启动和首次页面加载不计入结果
+        for tool in tools:
+            await runner._timed_call(tool)
+        server.state.reset()
+        rows = []
+        for tool in tools:
+            for level in levels:
+                row = await runner.run_level(tool, level)
+                rows.append(row)
+                print(f"完成 {tool} 并发{level}: p50={row['p50']:.3f}s 正确 {row['correct']}/{row['calls']}")
+        return {"rows": rows, "server": server.state.snapshot()["requests"], "metrics": m.metrics.snapshot()}
+    finally:
+        for account in m.account_scheduler.accounts:
+            if account.health_task:
+                account.health_task.cancel()
+            if account.context:
+                try:
+                    await account.context.close()
+                except Exception:
+                    pass
+        if m.playwright_instance:
+            await m.playwright_instance.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="xiaohongshu_mcp 离线基准测试")
+    parser.add_argument("--tools", default=",".join(BENCH_TOOLS), help="逗号分隔的工具名")
+    parser.add_argument("--concurrency", default="1,4,8", help="逗号分隔的并发数")
+    parser.add_argument("--calls", type=int, default=8, help="每档并发下每个工具的调用次数")
+    parser.add_argument("--page-latency", type=float, default=0.05, help="模拟页面响应延迟（秒）")
+    parser.add_argument("--api-latency", type=float, default=0.08, help="模拟接口响应延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.02, help="延迟随机抖动（秒）")
+    parser.add_argument("--no-capture", action="store_true", help="关闭接口捕获，只测试DOM解析路径")
+    parser.add_argument("--json", dest="json_path", help="把结果和 get_metrics 快照写入JSON文件")
+    args = parser.parse_args()
+
+    server = StubServer(StubConfig(args.page_latency, args.api_latency, args.jitter)).start()
+    work_dir = tempfile.mkdtemp(prefix="xhs_bench_")
+    os.environ.update({
+        "XHS_BASE_URL": server.base_url,
+        "XHS_BROWSER_DATA_DIR": os.path.join(work_dir, "browser_data"),
+        "XHS_DATA_DIR": os.path.join(work_dir, "data"),
+        "XHS_LAUNCH_PROFILE": "scrape",
+        "XHS_RATE_LIMIT_SCALE": "1000",  # 本地服务不需要限速，避免限速掩盖工具本身的耗时
+        "XHS_NETWORK_CAPTURE": "0" if args.no_capture else "1",
+    })
+    os.environ.setdefault("XHS_LOG_LEVEL", "WARNING")
+    try:
+        report = asyncio.run(run(args, server))
+    finally:
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print()
+    print_table(report["rows"])
+    print(f"\n模拟服务请求数: {report['server']}")
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
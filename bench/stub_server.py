@@ -0,0 +1,314 @@
+"""
+小红书页面与接口的本地模拟服务，供 run_bench.py 离线基准测试使用
+
+页面取自 fixtures/ 目录，DOM 结构与 xiaohongshu_mcp.py 使用的选择器一致；
+搜索、笔记详情、评论分页和发布评论接口返回与真实接口相同结构的JSON。
+可为页面和接口分别设置固定延迟和随机抖动，模拟真实网络环境。
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+NOTE_PATH_PREFIXES = ("/explore/", "/search_result/", "/discovery/item/")
+# 生成的笔记正文需超过 get_note_content 判定为有效内容的长度
+NOTE_CONTENT_SENTENCES = [
+    "今天分享一个周末就能完成的小项目，",
+    "从准备材料到最终完成大概需要三个小时，",
+    "过程中踩过的坑都整理在下面了，",
+    "新手按照步骤来基本不会出错，",
+    "有问题欢迎在评论区留言交流。",
+]
+BASE_TIMESTAMP_MS = 1700000000000
+
+
+class StubConfig:
+    """模拟服务的数据规模和延迟设置"""
+
+    def __init__(self, page_latency: float = 0.05, api_latency: float = 0.08, jitter: float = 0.02,
+                 search_total: int = 60, search_page_size: int = 20,
+                 comments_per_note: int = 40, comment_page_size: int = 10, replies_per_comment: int = 1):
+        self.page_latency = page_latency
+        self.api_latency = api_latency
+        self.jitter = jitter
+        self.search_total = search_total
+        self.search_page_size = search_page_size
+        self.comments_per_note = comments_per_note
+        self.comment_page_size = comment_page_size
+        self.replies_per_comment = replies_per_comment
+
+
+def _load_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURE_DIR, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def note_title(note_id: str) -> str:
+    return f"基准测试笔记 {note_id}"
+
+
+def note_author(note_id: str) -> str:
+    return f"作者{note_id[-3:]}"
+
+
+def note_content(note_id: str) -> str:
+    return f"[{note_id}] " + "".join(NOTE_CONTENT_SENTENCES)
+
+
+def search_note_id(keyword: str, index: int) -> str:
+    """同一关键词的搜索结果ID固定，便于核对返回数量和去重"""
+    return f"s{zlib.crc32(keyword.encode('utf-8')) % 100000:05d}n{index:04d}"
+
+
+class StubState:
+    """服务端共享状态：请求计数和已发布的评论"""
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.requests: Counter = Counter()
+        self.posted: Dict[str, List[str]] = {}
+        self.templates = {
+            "home": _load_fixture("home.html"),
+            "search": _load_fixture("search_result.html"),
+            "note": _load_fixture("note.html"),
+        }
+
+    def count(self, kind: str) -> None:
+        with self.lock:
+            self.requests[kind] += 1
+
+    def record_post(self, note_id: str, content: str) -> int:
+        with self.lock:
+            self.posted.setdefault(note_id, []).append(content)
+            return len(self.posted[note_id])
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "posted": {note_id: list(items) for note_id, items in self.posted.items()},
+            }
+
+    def reset(self) -> None:
+        with self.lock:
+            self.requests.clear()
+            self.posted.clear()
+
+    def render_note(self, note_id: str) -> str:
+        html = self.templates["note"]
+        fields = {
+            "note_id": note_id,
+            "author_id": f"u{note_id}",
+            "title": note_title(note_id),
+            "author": note_author(note_id),
+            "date": "2023-11-15 上海",
+            "content": note_content(note_id),
+            "comment_total": str(self.config.comments_per_note),
+        }
+        for key, value in fields.items():
+            html = html.replace("{{" + key + "}}", value)
+        return html
+
+    def search_payload(self, keyword: str, page: int) -> Dict[str, Any]:
+        config = self.config
+        start = (page - 1) * config.search_page_size
+        end = min(start + config.search_page_size, config.search_total)
+        items = []
+        for index in range(start, end):
+            note_id = search_note_id(keyword, index)
+            items.append({
+                "id": note_id,
+                "model_type": "note",
+                "xsec_token": f"tok{index}",
+                "note_card": {
+                    "display_title": f"{keyword} 相关笔记 {index}",
+                    "user": {"nickname": note_author(note_id)},
+                    "interact_info": {"liked_count": str(index * 7 % 1000)},
+                },
+            })
+        return {"success": True, "data": {"items": items, "has_more": end < config.search_total}}
+
+    def feed_payload(self, note_id: str) -> Dict[str, Any]:
+        return {"success": True, "data": {"items": [{"id": note_id, "note_card": {
+            "title": note_title(note_id),
+            "user": {"nickname": note_author(note_id)},
+            "time": BASE_TIMESTAMP_MS,
+            "ip_location": "上海",
+            "desc": note_content(note_id),
+        }}]}}
+
+    def _comment(self, note_id: str, index: int, reply: Optional[int] = None) -> Dict[str, Any]:
+        suffix = f"{index:04d}" if reply is None else f"{index:04d}r{reply}"
+        return {
+            "id": f"{note_id}c{suffix}",
+            "content": f"第{index}条评论" + ("" if reply is None else f"的第{reply}条回复"),
+            "user_info": {"nickname": f"用户{suffix}"},
+            "create_time": BASE_TIMESTAMP_MS + index * 60000,
+            "ip_location": "北京",
+            "like_count": str(index % 50),
+            "sub_comments": [],
+        }
+
+    def comments_payload(self, note_id: str, cursor: str) -> Dict[str, Any]:
+        config = self.config
+        start = int(cursor) if cursor.isdigit() else 0
+        end = min(start + config.comment_page_size, config.comments_per_note)
+        comments = []
+        if start == 0:
+            # 已发布的评论置顶，便于核对 post_comment 的结果
+            with self.lock:
+                posted = list(self.posted.get(note_id, []))
+            for position, content in reversed(list(enumerate(posted, 1))):
+                comment = self._comment(note_id, 9000 + position)
+                comment["content"] = content
+                comments.append(comment)
+        for index in range(start, end):
+            comment = self._comment(note_id, index)
+            comment["sub_comments"] = [self._comment(note_id, index, reply)
+                                       for reply in range(1, config.replies_per_comment + 1)]
+            comments.append(comment)
+        return {"success": True, "data": {"comments": comments, "cursor": str(end),
+                                          "has_more": end < config.comments_per_note}}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state: StubState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _delay(self, base: float) -> None:
+        jitter = self.state.config.jitter
+        delay = base + (random.uniform(-jitter, jitter) if jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _send(self, status: int, body: str, content_type: str, cookies: Optional[List[str]] = None) -> None:
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        for cookie in cookies or []:
+            self.send_header("Set-Cookie", cookie)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_html(self, body: str, cookies: Optional[List[str]] = None) -> None:
+        self._delay(self.state.config.page_latency)
+        self._send(200, body, "text/html", cookies)
+
+    def _send_json(self, payload: Dict[str, Any]) -> None:
+        self._delay(self.state.config.api_latency)
+        self._send(200, json.dumps(payload, ensure_ascii=False), "application/json")
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length).decode("utf-8"))
+        except ValueError:
+            return {}
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        path = parsed.path
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        state = self.state
+        if path in ("/", "/explore"):
+            state.count("page:home")
+            # 模拟登录态，ensure_browser 通过会话cookie判断已登录
+            self._send_html(state.templates["home"], cookies=["web_session=bench; Path=/"])
+        elif path == "/search_result":
+            state.count("page:search")
+            self._send_html(state.templates["search"])
+        elif path.startswith(NOTE_PATH_PREFIXES):
+            note_id = path.rstrip("/").rsplit("/", 1)[-1]
+            state.count("page:note")
+            self._send_html(state.render_note(note_id))
+        elif path == "/api/sns/web/v1/search/notes":
+            state.count("api:search")
+            self._send_json(state.search_payload(query.get("keyword", ""), max(int(query.get("page", "1")), 1)))
+        elif path == "/api/sns/web/v2/comment/page":
+            state.count("api:comments")
+            self._send_json(state.comments_payload(query.get("note_id", ""), query.get("cursor", "")))
+        elif path == "/favicon.ico":
+            self._send(204, "", "image/x-icon")
+        else:
+            state.count("other")
+            self._send(404, "not found", "text/plain")
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self._read_json()
+        state = self.state
+        if path == "/api/sns/web/v1/feed":
+            state.count("api:note")
+            self._send_json(state.feed_payload(body.get("source_note_id", "")))
+        elif path == "/api/sns/web/v1/comment/post":
+            state.count("api:post")
+            note_id = body.get("note_id", "")
+            content = body.get("content", "")
+            comment = state._comment(note_id, 9000 + state.record_post(note_id, content))
+            comment["content"] = content
+            self._send_json({"success": True, "data": {"comment": comment}})
+        else:
+            state.count("other")
+            self._send(404, "not found", "text/plain")
+
+
+class StubServer:
+    """在后台线程运行的模拟服务，port=0 时自动分配端口"""
+
+    def __init__(self, config: Optional[StubConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.state = StubState(config or StubConfig())
+        handler = type("BoundStubHandler", (StubHandler,), {"state": self.state})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="xhs-stub-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="小红书本地模拟服务")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--page-latency", type=float, default=0.05, help="页面响应延迟（秒）")
+    parser.add_argument("--api-latency", type=float, default=0.08, help="接口响应延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.02, help="延迟随机抖动（秒）")
+    args = parser.parse_args()
+    server = StubServer(StubConfig(args.page_latency, args.api_latency, args.jitter), port=args.port)
+    print(f"模拟服务已启动: {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,98 +1,1616 @@
-from typing import Any, List, Dict, Optional
+from typing import Any, Callable, List, Dict, Optional, Union
 import asyncio
+import bisect
+import contextvars
+import functools
+import hashlib
+import itertools
 import json
 import os
+import re
+import sqlite3
+import threading
+import time
 import pandas as pd
 from datetime import datetime
-from playwright.async_api import async_playwright
-from fastmcp import FastMCP
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+from fastmcp import Context, FastMCP
 import logging
-
-logging.basicConfig(level=logging.INFO)
+import math
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dataclasses import asdict, dataclass, is_dataclass
+from urllib.parse import parse_qs, urlparse
 
 # 初始化 FastMCP 服务器
 mcp = FastMCP("xiaohongshu_scraper")
 
 # 全局变量
-BROWSER_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "browser_data")
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# XHS_BROWSER_DATA_DIR / XHS_DATA_DIR 可改变浏览器数据和本地笔记库的位置；XHS_BASE_URL 可把所有页面请求
+# 指向其他地址（如 bench/ 中的本地模拟站点），默认即小红书站点
+BROWSER_DATA_DIR = os.environ.get("XHS_BROWSER_DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "browser_data")
+DATA_DIR = os.environ.get("XHS_DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+BASE_URL = os.environ.get("XHS_BASE_URL", "https://www.xiaohongshu.com").rstrip("/")
 TIMESTAMP = datetime.now().strftime("%Y%m%d_%H%M%S")
 
 # 确保目录存在
 os.makedirs(BROWSER_DATA_DIR, exist_ok=True)
 os.makedirs(DATA_DIR, exist_ok=True)
 
-# 用于存储浏览器上下文，以便在不同方法之间共享
-browser_context = None
-main_page = None
-is_logged_in = False
-context_restart_lock = asyncio.Lock()
+# 浏览器启动配置：login 为有界面模式，用于首次扫码登录；scrape 为无界面模式，
+# 与 login 共用 BROWSER_DATA_DIR 中的登录状态，并拦截图片、视频、字体和统计请求
+LAUNCH_PROFILES = {
+    "login": {"headless": False, "block_resources": False},
+    "scrape": {"headless": True, "block_resources": True},
+}
+DEFAULT_LAUNCH_PROFILE = os.environ.get("XHS_LAUNCH_PROFILE", "login")
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+BLOCKED_URL_PATTERNS = ["apm-fe.xiaohongshu.com", "t2.xiaohongshu.com", "/api/sec/v1/sbtsource",
+                        "google-analytics.com", "googletagmanager.com", "sentry"]
+# 各工具是否拦截资源请求（仅在启动配置开启 block_resources 时生效），发布评论需要完整页面
+TOOL_RESOURCE_BLOCKING = {
+    "search_notes": True,
+    "get_note_content": True,
+    "get_note_comments": True,
+    "post_comment": False,
+}
+
+# 多账号：XHS_ACCOUNTS 为逗号分隔的账号名，每个账号使用独立的用户数据目录（browser_data_<账号名>）
+# 和登录状态；未配置时只有一个默认账号，直接使用 BROWSER_DATA_DIR
+ACCOUNT_NAMES = [name.strip() for name in os.environ.get("XHS_ACCOUNTS", "").split(",") if name.strip()]
+ACCOUNT_SCHEDULING = os.environ.get("XHS_ACCOUNT_SCHEDULING", "least_loaded")  # least_loaded 或 round_robin
+ACCOUNT_QUARANTINE_SECONDS = 600  # 账号遇到登录墙或验证码后暂停调度的时间（秒）
+ACCOUNT_THROTTLE_QUARANTINE_SECONDS = 300  # 账号的请求返回限流状态码（RATE_BLOCKED_STATUSES）后暂停调度的时间（秒）
+# 工具页面跳转到这些地址，说明账号被要求重新登录或触发了验证码
+BLOCKED_PAGE_MARKERS = ["/website-login/captcha", "/website-login/error", "/login?redirectPath"]
+
+# 页面加载限速：令牌桶按 域名 / 账号 / 工具类别（读取 read、发评论 post）分别限速，
+# rate 为每秒补充的令牌数，burst 为桶容量；一次页面加载需要同时从三个桶各取一个令牌
+RATE_LIMIT_SCALE = float(os.environ.get("XHS_RATE_LIMIT_SCALE", "1"))  # 整体放大或缩小所有速率
+RATE_LIMITS = {
+    "host": {"rate": 1.0, "burst": 4},
+    "account": {"rate": 0.5, "burst": 3},
+    "read": {"rate": 1.0, "burst": 4},
+    "post": {"rate": 1 / 30, "burst": 1},
+}
+TOOL_RATE_CLASSES = {"post_comment": "post"}  # 未列出的工具都属于read
+# 排队优先级，数字越小越先执行
+TOOL_PRIORITIES = {"post_comment": 0, "get_note_content": 1, "get_note_comments": 1, "search_notes": 2}
+RATE_SLOW_RESPONSE_SECONDS = 10  # 页面加载超过该时间视为响应变慢
+RATE_BLOCKED_STATUSES = {429, 461, 471}  # 限流/验证码状态码
+RATE_BACKOFF_PAUSE = 60  # 遇到验证码或登录墙后相关令牌桶暂停的时间（秒）
+RATE_MIN_FACTOR = 0.125  # 退避后速率最低降到原速率的比例
+
+# 登录状态：未登录的访客也会拿到 web_session，cookie本身不能说明已登录。首页确认已登录（或扫码后会话cookie
+# 相对访客值发生变化）时记下该会话值的哈希，保存在账号目录的 LOGIN_SESSION_MARKER 中；之后会话值不变即视为已登录，
+# 无需打开页面。检查结果按有效/无效分别缓存一段时间（秒）
+LOGIN_COOKIE_NAMES = ["web_session"]
+LOGIN_COOKIE_URL = BASE_URL
+LOGIN_SESSION_MARKER = "xhs_login_session"
+LOGIN_STATE_TTLS = {"valid": 600, "invalid": 30}
+
+# 标签页池配置：池大小即同时打开的工具标签页上限
+PAGE_POOL_SIZE = int(os.environ.get("XHS_PAGE_POOL_SIZE", "4"))
+PAGE_HEALTH_CHECK_TIMEOUT = 5  # 复用标签页前健康检查的超时时间（秒）
+BROWSER_HEALTH_INTERVAL = 30  # 后台检查浏览器健康状态的间隔（秒）
+BROWSER_HEALTH_MAX_FAILURES = 2  # main_page连续多少次无响应后判定为失效
+
+# 网络捕获模式：优先解析页面自身请求到的JSON接口数据，未捕获到时回退到DOM解析
+NETWORK_CAPTURE_ENABLED = os.environ.get("XHS_NETWORK_CAPTURE", "1") == "1"
+NETWORK_CAPTURE_TIMEOUT = 8  # 等待接口响应的最长时间（秒）
+
+# 结果缓存：各工具的缓存有效期（秒）及缓存总预算
+CACHE_TTLS = {
+    "search_notes": 300,
+    "get_note_content": 1800,
+    "get_note_comments": 300,
+}
+CACHE_MAX_ENTRIES = int(os.environ.get("XHS_CACHE_MAX_ENTRIES", "512"))
+CACHE_MAX_BYTES = int(os.environ.get("XHS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# 本地笔记库：持久化抓取结果，未过期的数据重启后也无需重新抓取
+NOTE_STORE_PATH = os.path.join(DATA_DIR, "notes.db")
+STORE_MAX_AGES = {
+    "note": 24 * 3600,
+    "comments": 3600,
+}
+
+# 搜索结果滚动加载：默认时间预算（秒），以及连续多少轮没有新笔记时停止
+SEARCH_SCROLL_BUDGET = 30
+SEARCH_SCROLL_IDLE_ROUNDS = 3
+
+# 评论加载：默认目标评论数、时间预算（秒），以及评论数连续多少轮不增长时停止
+COMMENT_TARGET_COUNT = 100
+COMMENT_LOAD_BUDGET = 30
+COMMENT_IDLE_ROUNDS = 2
+
+# 批量工具：单次批量调用允许的最大并发数及单条默认超时（秒）
+BATCH_MAX_CONCURRENCY = int(os.environ.get("XHS_BATCH_MAX_CONCURRENCY", "8"))
+BATCH_ITEM_TIMEOUT = 120
+
+# 笔记分析：领域词表可通过 XHS_DOMAIN_LEXICON 指向的JSON文件（{领域: [关键词, ...]}）替换，
+# 文件不存在时使用内置词表；没有命中任何领域时归为 DOMAIN_FALLBACK
+DOMAIN_LEXICON_PATH = os.environ.get("XHS_DOMAIN_LEXICON", os.path.join(DATA_DIR, "domain_lexicon.json"))
+DEFAULT_DOMAIN_LEXICON = {
+    "美妆": ["口红", "粉底", "眼影", "护肤", "美妆", "化妆", "保湿", "精华", "面膜"],
+    "穿搭": ["穿搭", "衣服", "搭配", "时尚", "风格", "单品", "衣橱", "潮流"],
+    "美食": ["美食", "好吃", "食谱", "餐厅", "小吃", "甜点", "烘焙", "菜谱"],
+    "旅行": ["旅行", "旅游", "景点", "出行", "攻略", "打卡", "度假", "酒店"],
+    "母婴": ["宝宝", "母婴", "育儿", "儿童", "婴儿", "辅食", "玩具"],
+    "数码": ["数码", "手机", "电脑", "相机", "智能", "设备", "科技"],
+    "家居": ["家居", "装修", "家具", "设计", "收纳", "布置", "家装"],
+    "健身": ["健身", "运动", "瘦身", "减肥", "训练", "塑形", "肌肉"],
+    "AI": ["AI", "人工智能", "大模型", "编程", "开发", "技术", "Claude", "GPT"]
+}
+DOMAIN_FALLBACK = "生活"
+# 关键词提取：中文先在 KEYWORD_STOP_WORDS（多字停用词，整词匹配）处断开，再按2~3字n-gram切分，
+# 以 KEYWORD_STOP_PARTICLES 中的语气词/助词开头或结尾的n-gram不作为关键词。“在/不/有/一”等单字常出现在
+# 现在、不错、有效、一定这类实词中，不作为断开或过滤的依据；
+# 3字n-gram在同一篇笔记中至少出现 KEYWORD_MIN_LONG_GRAM_FREQ 次才作为关键词，避免跨词拼接的片段
+KEYWORD_NGRAM_SIZES = (2, 3)
+KEYWORD_MIN_LONG_GRAM_FREQ = 2
+KEYWORD_STOP_WORDS = [
+    "我们", "你们", "他们", "她们", "它们", "可以", "一个", "没有", "不是", "就是", "什么", "这个", "那个",
+    "自己", "大家", "还是", "但是", "因为", "所以", "如果", "真的", "觉得", "已经", "一下", "起来", "出来",
+    "怎么", "这样", "那样", "然后", "还有", "一些", "这些", "那些", "的话", "非常", "特别",
+]
+KEYWORD_STOP_PARTICLES = ["的", "了", "吗", "呢", "吧", "啊", "哦", "呀", "嘛", "哈"]
+
+# 选择器自适应：记录各字段每种提取策略的成功率和耗时，按历史表现调整尝试顺序，统计保存在本地重启后沿用。
+# 计数按 SELECTOR_STATS_DECAY 指数衰减，页面改版后失效的策略会被降到后面，仍然有效的策略保持原始顺序；XHS_ADAPTIVE_SELECTORS=0 恢复固定顺序
+ADAPTIVE_SELECTORS_ENABLED = os.environ.get("XHS_ADAPTIVE_SELECTORS", "1") == "1"
+SELECTOR_STATS_PATH = os.path.join(DATA_DIR, "selector_stats.json")
+SELECTOR_STATS_DECAY = 0.95
+SELECTOR_DEMOTE_RATE = 0.4  # 平滑成功率低于此值的策略才会被降到后面
+SELECTOR_PROBE_INTERVAL = 20  # 每个字段每隔多少次提取按原始顺序重新尝试一次
+SELECTOR_STATS_SAVE_INTERVAL = 30  # 统计写盘的最小间隔（秒）
+
+# 各工具等待页面就绪的时间预算（秒），超出预算后直接进入提取逻辑
+READY_TIMEOUTS = {
+    "search_notes": 15,
+    "get_note_content": 15,
+    "get_note_comments": 10,
+    "post_comment": 10,
+}
+
+# 日志：XHS_LOG_LEVEL 为全局日志级别；XHS_TOOL_LOG_LEVELS 按工具单独设置，如 "search_notes=DEBUG,post_comment=WARNING"。
+# XHS_DEBUG=1 开启调试诊断（页面HTML片段等），需要额外读取页面，关闭时完全不与浏览器通信
+DEBUG_DIAGNOSTICS = os.environ.get("XHS_DEBUG", "0") == "1"
+LOG_LEVEL = os.environ.get("XHS_LOG_LEVEL", "DEBUG" if DEBUG_DIAGNOSTICS else "INFO").upper()
+TOOL_LOG_LEVELS = dict(item.split("=", 1) for item in os.environ.get("XHS_TOOL_LOG_LEVELS", "").split(",") if "=" in item)
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+DEBUG_HTML_SNIPPET = (10000, 10500)  # 调试模式下记录的页面HTML片段范围
+
+# 性能指标：各工具各阶段耗时的直方图分桶上界（秒）；设置 XHS_METRICS_PORT 后额外提供Prometheus格式的 /metrics 接口
+METRIC_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+METRICS_PORT = int(os.environ.get("XHS_METRICS_PORT", "0"))
+
+# 所有账号共用一个playwright实例
+playwright_instance = None
+
+
+logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+logger = logging.getLogger("xiaohongshu_mcp")
+for _tool, _level in TOOL_LOG_LEVELS.items():
+    logger.getChild(_tool.strip()).setLevel(_level.strip().upper())
+search_logger = logger.getChild("search_notes")
+note_logger = logger.getChild("get_note_content")
+comment_logger = logger.getChild("get_note_comments")
+post_logger = logger.getChild("post_comment")
+
+
+# 当前正在执行的工具名，由 instrumented 设置，各阶段计时和计数据此归属到工具
+current_tool: contextvars.ContextVar[str] = contextvars.ContextVar("current_tool", default="-")
+
+
+class Histogram:
+    """固定分桶直方图，记录次数、总和、最大值，并按分桶估算分位数"""
+
+    def __init__(self, buckets: tuple = METRIC_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """返回第q分位所在分桶的上界（最后一个分桶用最大值）"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "avg": round(self.sum / self.count, 3) if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": round(self.max, 3),
+        }
+
+
+class Metrics:
+    """工具调用指标：各阶段耗时直方图，以及缓存命中、重试、提取方法胜出等计数"""
+
+    def __init__(self):
+        self.timings: Dict[tuple, Histogram] = {}
+        self.counters: Dict[tuple, int] = {}
+
+    def observe(self, phase: str, seconds: float, tool: Optional[str] = None) -> None:
+        key = (tool or current_tool.get(), phase)
+        histogram = self.timings.get(key)
+        if histogram is None:
+            histogram = self.timings[key] = Histogram()
+        histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, phase: str, tool: Optional[str] = None):
+        """记录with块的耗时，异常退出时同样计入"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.monotonic() - start, tool)
+
+    def incr(self, name: str, value: str = "", tool: Optional[str] = None, amount: int = 1) -> None:
+        """计数，如 incr("cache", "hit")、incr("field_method", "标题:selector")"""
+        key = (tool or current_tool.get(), name, value)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def snapshot(self) -> Dict[str, Any]:
+        timings: Dict[str, Dict[str, Any]] = {}
+        for (tool, phase), histogram in list(self.timings.items()):
+            timings.setdefault(tool, {})[phase] = histogram.summary()
+        counters: Dict[str, Dict[str, int]] = {}
+        for (tool, name, value), count in list(self.counters.items()):
+            counters.setdefault(tool, {})[f"{name}:{value}" if value else name] = count
+        return {"timings": timings, "counters": counters}
+
+    def prometheus(self) -> str:
+        """Prometheus文本格式"""
+        lines = ["# TYPE xhs_phase_seconds histogram"]
+        for (tool, phase), histogram in list(self.timings.items()):
+            labels = f'tool="{tool}",phase="{phase}"'
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                cumulative += bucket_count
+                lines.append(f'xhs_phase_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'xhs_phase_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"xhs_phase_seconds_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"xhs_phase_seconds_count{{{labels}}} {histogram.count}")
+        lines.append("# TYPE xhs_events_total counter")
+        for (tool, name, value), count in list(self.counters.items()):
+            value = value.replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'xhs_events_total{{tool="{tool}",event="{name}",value="{value}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def _is_error_result(result: Any) -> bool:
+    if isinstance(result, dict):
+        return "error" in result
+    return isinstance(result, str) and (result.startswith("请先登录") or "时出错" in result[:20])
+
+
+class ProgressReporter:
+    """把工具的阶段性结果（已加载的搜索卡片、评论、批量条目）作为MCP进度通知发给客户端
+
+    客户端可在结果全部返回前开始处理，拿到足够数据后取消调用以节省浏览器时间。
+    MCP要求同一调用的progress单调递增，不递增的进度会被丢弃。
+    """
+
+    def __init__(self, ctx: Context):
+        self.ctx = ctx
+        self.last_progress = None
+
+    async def report(self, progress: float, total: Optional[float] = None, message: str = "") -> None:
+        if self.last_progress is not None and progress <= self.last_progress:
+            return
+        self.last_progress = progress
+        try:
+            try:
+                await self.ctx.report_progress(progress, total, message or None)
+            except TypeError:
+                # 旧版本的 report_progress 不支持 message 参数，阶段性结果改为日志通知发送
+                await self.ctx.report_progress(progress, total)
+                if message:
+                    await self.ctx.info(message)
+        except Exception as e:
+            logger.debug("发送进度通知失败: %s", e)
+
+
+# 当前调用的进度通知对象，由 instrumented 按工具的 ctx 参数设置；工具内部互相调用时没有ctx，不发送通知
+current_progress: contextvars.ContextVar[Optional[ProgressReporter]] = contextvars.ContextVar("current_progress", default=None)
+
+
+async def report_progress(progress: float, total: Optional[float] = None, message: str = "") -> None:
+    """向当前调用的客户端发送进度通知，客户端未请求进度时不做任何事"""
+    reporter = current_progress.get()
+    if reporter is not None:
+        await reporter.report(progress, total, message)
+
+
+def instrumented(func):
+    """工具函数装饰器：设置current_tool和current_progress并记录总耗时和调用结果，放在 @mcp.tool() 之下"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = current_tool.set(func.__name__)
+        ctx = kwargs.get("ctx")
+        progress_token = current_progress.set(ProgressReporter(ctx) if ctx is not None else None)
+        outcome = "error"
+        try:
+            with metrics.timer("total"):
+                result = await func(*args, **kwargs)
+            outcome = "error" if _is_error_result(result) else "ok"
+            return result
+        finally:
+            metrics.incr("calls", outcome)
+            current_progress.reset(progress_token)
+            current_tool.reset(token)
+    return wrapper
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics: " + format, *args)
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """在后台线程中提供 /metrics 接口（仅监听本机）"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="xhs-metrics", daemon=True).start()
+    logger.info("Prometheus指标接口: http://127.0.0.1:%d/metrics", port)
+    return server
+
+
+async def debug_dump_html(page, log: logging.Logger, label: str) -> None:
+    """调试模式下记录页面HTML片段；未开启调试或该日志器未启用DEBUG级别时直接返回，不读取页面"""
+    if not DEBUG_DIAGNOSTICS or not log.isEnabledFor(logging.DEBUG):
+        return
+    try:
+        page_html = await page.content()
+    except Exception as e:
+        log.debug("%s: 读取页面HTML失败: %s", label, e)
+        return
+    start, end = DEBUG_HTML_SNIPPET
+    log.debug("%s: 页面HTML共 %d 字符，片段: %s...", label, len(page_html), page_html[start:end])
+
+
+class PagePool:
+    """标签页池：复用账号浏览器上下文中的标签页，限制同时打开的标签页数量
+
+    acquire() 优先复用空闲标签页（复用前做健康检查），不足时才新建；
+    release() 把标签页重置为空白页后放回池中，已崩溃或已关闭的标签页直接淘汰。
+    """
+
+    def __init__(self, size: int, account: "BrowserAccount"):
+        self.size = size
+        self.account = account
+        self._semaphore: Optional[asyncio.Semaphore] = None  # 在事件循环中首次借出时创建，见 acquire()
+        self._idle: List[Any] = []
+        self._crashed: set = set()
+        self._routes: Dict[Any, Any] = {}
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "idle": len(self._idle),
+            "created": self.created,
+            "reused": self.reused,
+            "evicted": self.evicted,
+        }
+
+    def _on_crash(self, page) -> None:
+        logger.warning("标签页崩溃，将从池中淘汰: %s", page)
+        self._crashed.add(page)
+
+    async def _evict(self, page) -> None:
+        self._crashed.discard(page)
+        self._routes.pop(page, None)
+        self.evicted += 1
+        try:
+            if not page.is_closed():
+                await page.close()
+        except Exception as e:
+            logger.warning("关闭被淘汰的标签页出错: %s", e)
+
+    async def _is_healthy(self, page) -> bool:
+        if page in self._crashed or page.is_closed():
+            return False
+        try:
+            await asyncio.wait_for(page.evaluate("() => document.readyState"), timeout=PAGE_HEALTH_CHECK_TIMEOUT)
+            return True
+        except Exception:
+            return False
+
+    async def acquire(self, tool: Optional[str] = None):
+        """从池中借出一个可用标签页，池满时等待其他调用归还
+
+        Args:
+            tool: 调用方工具名，用于决定是否为该标签页开启资源拦截
+        """
+        if self._semaphore is None:
+            # Python 3.9 的 Semaphore 在创建时绑定事件循环，模块导入时创建会与 mcp.run 的循环不一致
+            self._semaphore = asyncio.Semaphore(self.size)
+        await self._semaphore.acquire()
+        try:
+            page = None
+            while self._idle:
+                candidate = self._idle.pop()
+                if await self._is_healthy(candidate):
+                    self.reused += 1
+                    page = candidate
+                    break
+                await self._evict(candidate)
+            if page is None:
+                page = await self.account.context.new_page()
+                page.set_default_timeout(60000)
+                page.on("crash", self._on_crash)
+                self.created += 1
+            if should_block_resources(tool, self.account.profile):
+                await page.route("**/*", _block_route)
+                self._routes[page] = _block_route
+            return page
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    async def release(self, page) -> None:
+        """归还标签页：重置为空白页后放回池中，无法重置的直接淘汰"""
+        try:
+            if page in self._crashed or page.is_closed():
+                await self._evict(page)
+                return
+            try:
+                handler = self._routes.pop(page, None)
+                if handler:
+                    await page.unroute("**/*", handler)
+                await page.goto("about:blank", timeout=PAGE_HEALTH_CHECK_TIMEOUT * 1000)
+            except Exception as e:
+                logger.warning("重置标签页失败，将其淘汰: %s", e)
+                await self._evict(page)
+                return
+            self._idle.append(page)
+        finally:
+            self._semaphore.release()
+
+    def reset(self) -> None:
+        """浏览器上下文重启后丢弃旧上下文的所有空闲标签页"""
+        self._idle.clear()
+        self._crashed.clear()
+        self._routes.clear()
+
+
+class BrowserAccount:
+    """一个账号：独立的持久化浏览器上下文、登录状态、标签页池和当前负载"""
+
+    def __init__(self, name: str, user_data_dir: str):
+        self.name = name
+        self.user_data_dir = user_data_dir
+        self.context = None
+        self.profile = None
+        self.main_page = None
+        self.is_logged_in = False
+        self.login_checked_at = None
+        self.context_closed = False
+        self.main_page_crashed = False
+        self._restart_lock: Optional[asyncio.Lock] = None
+        self.health_task = None
+        self.page_pool = PagePool(PAGE_POOL_SIZE, self)
+        self.in_flight = 0
+        self.quarantined_until = 0.0
+        self.quarantine_reason = ""
+        self.guest_session: Optional[str] = None  # 已确认未登录时的会话cookie值（没有cookie为空串，未知为None）
+        self.confirmed_session: Optional[str] = self._load_confirmed_session()  # 已确认登录的会话值哈希
+
+    @property
+    def restart_lock(self) -> asyncio.Lock:
+        """浏览器重启锁，在事件循环中首次使用时创建（Python 3.9 的 Lock 在创建时绑定事件循环）"""
+        if self._restart_lock is None:
+            self._restart_lock = asyncio.Lock()
+        return self._restart_lock
+
+    def on_context_close(self, context) -> None:
+        # 切换启动配置时旧context的close事件可能晚于新context启动，只处理当前context
+        if context is self.context:
+            self.context_closed = True
+
+    def on_main_page_crash(self, page) -> None:
+        if page is self.main_page:
+            logger.warning("账号 %s 主标签页崩溃", self.name)
+            self.main_page_crashed = True
+
+    def is_healthy(self) -> bool:
+        """只读取由事件和后台检查维护的状态，不与浏览器通信"""
+        return (self.context is not None and not self.context_closed and self.main_page is not None
+                and not self.main_page_crashed and not self.main_page.is_closed())
+
+    def start_health_monitor(self) -> None:
+        if self.health_task is not None:
+            self.health_task.cancel()
+        self.health_task = asyncio.ensure_future(self._monitor_health(self.context))
+
+    async def _monitor_health(self, context) -> None:
+        """定期ping主标签页，连续无响应时标记为失效，由下一次ensure_browser重新打开"""
+        failures = 0
+        while context is self.context and not self.context_closed:
+            await asyncio.sleep(BROWSER_HEALTH_INTERVAL)
+            # 重启或登录检查期间主标签页可能正在跳转，跳过本轮
+            if context is not self.context or self.restart_lock.locked() or self.main_page_crashed:
+                continue
+            try:
+                await asyncio.wait_for(self.main_page.evaluate("1"), timeout=PAGE_HEALTH_CHECK_TIMEOUT)
+                failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                logger.warning("账号 %s 主标签页无响应（第%s次）: %s", self.name, failures, e)
+                if failures >= BROWSER_HEALTH_MAX_FAILURES:
+                    self.main_page_crashed = True
+                    failures = 0
+
+    def cached_login_state(self) -> Optional[bool]:
+        """返回缓存的登录状态，从未检查或缓存已过期时返回None"""
+        if self.login_checked_at is None:
+            return None
+        ttl = LOGIN_STATE_TTLS["valid" if self.is_logged_in else "invalid"]
+        if time.monotonic() - self.login_checked_at > ttl:
+            return None
+        return self.is_logged_in
+
+    def set_login_state(self, logged_in: bool) -> None:
+        self.is_logged_in = logged_in
+        self.login_checked_at = time.monotonic()
+
+    def invalidate_login(self) -> None:
+        """工具页面遇到登录墙时调用，不主动探测；已确认的会话值作废，下次检查需重新打开首页确认"""
+        self.set_login_state(False)
+        self.confirmed_session = None
+        self.guest_session = None
+        try:
+            os.remove(self._marker_path())
+        except OSError:
+            pass
+
+    def _marker_path(self) -> str:
+        return os.path.join(self.user_data_dir, LOGIN_SESSION_MARKER)
+
+    def _load_confirmed_session(self) -> Optional[str]:
+        try:
+            with open(self._marker_path(), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    @staticmethod
+    def _session_digest(value: str) -> str:
+        return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+    def confirm_session(self, value: Optional[str]) -> None:
+        """记录已确认登录的会话值（只保存哈希），重启后会话值不变即可直接判定为已登录"""
+        if not value:
+            return
+        digest = self._session_digest(value)
+        if digest == self.confirmed_session:
+            return
+        self.confirmed_session = digest
+        try:
+            os.makedirs(self.user_data_dir, exist_ok=True)
+            with open(self._marker_path(), "w", encoding="utf-8") as f:
+                f.write(digest)
+        except OSError as e:
+            logger.warning("账号 %s 登录标记写入失败: %s", self.name, e)
+
+    async def session_cookie(self) -> Optional[str]:
+        """返回context中未过期的会话cookie值，只读取浏览器cookie，不打开页面"""
+        now = time.time()
+        for cookie in await self.context.cookies(LOGIN_COOKIE_URL):
+            if cookie["name"] in LOGIN_COOKIE_NAMES and cookie.get("value") \
+                    and (cookie.get("expires", -1) == -1 or cookie["expires"] > now):
+                return cookie["value"]
+        return None
+
+    async def refresh_login_state(self, probe: bool = True) -> bool:
+        """重新检查登录状态
+
+        会话值与已确认登录的值相同，或已知访客值而会话值变了（扫码登录后会重新下发），判定为已登录；
+        否则probe为True时打开首页查找登录按钮确认，并记下确认结果对应的会话值。
+
+        Args:
+            probe: cookie无法判定时是否打开首页确认
+        """
+        session = await self.session_cookie()
+        logged_in = bool(session) and (self._session_digest(session) == self.confirmed_session
+                                       or (self.guest_session is not None and session != self.guest_session))
+        if not logged_in and probe:
+            await self.main_page.goto(BASE_URL, timeout=60000)
+            await asyncio.sleep(3)
+            logged_in = not await self.main_page.query_selector_all('text="登录"')
+            session = await self.session_cookie()
+            if not logged_in:
+                self.guest_session = session or ""
+        if logged_in:
+            self.confirm_session(session)
+        self.set_login_state(logged_in)
+        logger.info("账号 %s 登录状态: %s", self.name, '已登录' if logged_in else '未登录')
+        return logged_in
+
+    def is_quarantined(self) -> bool:
+        return time.monotonic() < self.quarantined_until
+
+    def quarantine(self, reason: str, seconds: float = ACCOUNT_QUARANTINE_SECONDS) -> None:
+        logger.warning("账号 %s 暂停调度 %s 秒: %s", self.name, seconds, reason)
+        self.quarantined_until = time.monotonic() + seconds
+        self.quarantine_reason = reason
+
+    def release_quarantine(self) -> None:
+        self.quarantined_until = 0.0
+        self.quarantine_reason = ""
+
+
+class AccountScheduler:
+    """在多个账号之间调度工具请求：按最少负载或轮询选择账号，跳过未登录和被暂停的账号"""
+
+    def __init__(self, accounts: List[BrowserAccount], strategy: str = "least_loaded"):
+        self.accounts = accounts
+        self.strategy = strategy
+        self._next_index = 0
+        self._page_accounts: Dict[Any, BrowserAccount] = {}
+
+    @property
+    def default(self) -> BrowserAccount:
+        return self.accounts[0]
+
+    def account_of(self, page) -> Optional[BrowserAccount]:
+        return self._page_accounts.get(page)
+
+    def get(self, name: str) -> Optional[BrowserAccount]:
+        for account in self.accounts:
+            if account.name == name:
+                return account
+        return None
+
+    def _ordered_candidates(self) -> List[BrowserAccount]:
+        candidates = [account for account in self.accounts if not account.is_quarantined()]
+        if self.strategy == "round_robin":
+            start = self._next_index % len(self.accounts)
+            self._next_index += 1
+            return sorted(candidates, key=lambda account: (self.accounts.index(account) - start) % len(self.accounts))
+        return sorted(candidates, key=lambda account: account.in_flight)
+
+    async def acquire_page(self, tool: str):
+        """为工具选择一个已登录的账号并借出标签页，没有可用账号时返回None"""
+        with metrics.timer("acquire_page"):
+            return await self._acquire_page(tool)
+
+    async def _acquire_page(self, tool: str):
+        for account in self._ordered_candidates():
+            if not await ensure_browser(account=account):
+                logger.info("账号 %s 未登录，跳过", account.name)
+                continue
+            account.in_flight += 1
+            try:
+                page = await account.page_pool.acquire(tool)
+            except BaseException:
+                account.in_flight -= 1
+                raise
+            self._page_accounts[page] = account
+            logger.info("%s 使用账号 %s（当前负载 %s）", tool, account.name, account.in_flight)
+            return page
+        return None
+
+    async def release_page(self, page) -> None:
+        """归还标签页；若页面停在登录墙或验证码页，暂停该账号的调度（限流状态码在 paced_goto 中处理）"""
+        account = self._page_accounts.pop(page, None)
+        if account is None:
+            return
+        try:
+            if not page.is_closed() and any(marker in page.url for marker in BLOCKED_PAGE_MARKERS):
+                account.invalidate_login()
+                account.quarantine(f"页面跳转到 {page.url}")
+        finally:
+            account.in_flight -= 1
+            await account.page_pool.release(page)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [{
+            "name": account.name,
+            "profile": account.profile,
+            "logged_in": account.is_logged_in,
+            "in_flight": account.in_flight,
+            "quarantined": account.is_quarantined(),
+            "quarantine_reason": account.quarantine_reason if account.is_quarantined() else "",
+        } for account in self.accounts]
+
+
+def _build_accounts() -> List[BrowserAccount]:
+    if not ACCOUNT_NAMES:
+        return [BrowserAccount("default", BROWSER_DATA_DIR)]
+    accounts = []
+    for name in ACCOUNT_NAMES:
+        user_data_dir = f"{BROWSER_DATA_DIR}_{name}"
+        os.makedirs(user_data_dir, exist_ok=True)
+        accounts.append(BrowserAccount(name, user_data_dir))
+    return accounts
+
+
+account_scheduler = AccountScheduler(_build_accounts(), ACCOUNT_SCHEDULING)
+
+
+class TokenBucket:
+    """令牌桶：rate为每秒补充的令牌数，退避时按factor降低速率并可暂停一段时间"""
+
+    def __init__(self, rate: float, burst: float):
+        self.base_rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.factor = 1.0
+        self.paused_until = 0.0
+        self.updated = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        return self.base_rate * self.factor
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """距离桶中有一个可用令牌还需等待的秒数"""
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        self.tokens -= 1
+
+    def penalize(self, factor: float, pause: float = 0) -> None:
+        self._refill(time.monotonic())
+        self.factor = max(RATE_MIN_FACTOR, self.factor * factor)
+        if pause:
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            self.tokens = 0
+
+    def recover(self) -> None:
+        if self.factor < 1.0:
+            self._refill(time.monotonic())
+            self.factor = min(1.0, self.factor * 1.1)
+
+
+class RateLimiter:
+    """页面加载限速器：请求按优先级排队，所有相关令牌桶都有令牌的请求中优先级最高的先放行"""
+
+    def __init__(self, limits: Dict[str, Dict[str, float]], scale: float = 1.0):
+        self.limits = limits
+        self.scale = scale
+        self._buckets: Dict[tuple, TokenBucket] = {}
+        self._queue: List[list] = []  # [优先级, 序号, keys, 放行Future]，按优先级和序号保持有序
+        self._seq = itertools.count()
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.max_depth = 0
+        self.backoffs: Dict[str, int] = {}
+
+    def _bucket(self, key: tuple) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            conf = self.limits[key[0]]
+            bucket = TokenBucket(conf["rate"] * self.scale, conf["burst"])
+            self._buckets[key] = bucket
+        return bucket
+
+    def _dispatch(self) -> Optional[float]:
+        """按优先级依次放行所有令牌桶都有令牌的请求，返回剩余请求中最早可放行的等待秒数（队列为空时为None）
+
+        被自身令牌桶卡住的请求不会挡住后面使用其他令牌桶的请求；同时就绪时仍按优先级先后放行。
+        """
+        now = time.monotonic()
+        soonest = None
+        for entry in self._queue:
+            keys, granted = entry[2], entry[3]
+            if granted.done():
+                continue
+            buckets = [self._bucket(key) for key in keys]
+            wait = max(bucket.delay(now) for bucket in buckets)
+            if wait <= 0:
+                for bucket in buckets:
+                    bucket.consume()
+                granted.set_result(True)
+            elif soonest is None or wait < soonest:
+                soonest = wait
+        return soonest
+
+    async def acquire(self, keys: List[tuple], priority: int = 1) -> float:
+        """排队等待直到keys对应的令牌桶都有令牌，返回等待的秒数
+
+        Args:
+            keys: 令牌桶标识列表，如 [("host", 域名), ("account", 账号名), ("read",)]
+            priority: 排队优先级，数字越小越先放行
+        """
+        granted = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._seq), keys, granted]
+        bisect.insort(self._queue, entry)
+        self.max_depth = max(self.max_depth, len(self._queue))
+        start = time.monotonic()
+        try:
+            while not granted.done():
+                wait = self._dispatch()
+                if granted.done():
+                    break
+                # 等待被其他请求的放行检查放行，或到最早有令牌补充的时刻自己再检查一次
+                await asyncio.wait({granted}, timeout=wait)
+        finally:
+            self._queue.remove(entry)
+        waited = time.monotonic() - start
+        self.granted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def report(self, keys: List[tuple], outcome: str) -> None:
+        """根据页面加载结果调整速率：blocked 降速并暂停，slow 降速，ok 逐步恢复"""
+        if outcome != "ok":
+            self.backoffs[outcome] = self.backoffs.get(outcome, 0) + 1
+        for key in keys:
+            bucket = self._bucket(key)
+            if outcome == "blocked":
+                bucket.penalize(0.5, RATE_BACKOFF_PAUSE)
+            elif outcome == "slow":
+                bucket.penalize(0.75)
+            else:
+                bucket.recover()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": len(self._queue),
+            "max_queue_depth": self.max_depth,
+            "granted": self.granted,
+            "avg_wait": round(self.total_wait / self.granted, 3) if self.granted else 0.0,
+            "max_wait": round(self.max_wait, 3),
+            "backoffs": dict(self.backoffs),
+            "buckets": {
+                ":".join(key): {
+                    "rate": round(bucket.rate, 4),
+                    "tokens": round(bucket.tokens, 2),
+                    "paused": bucket.paused_until > time.monotonic(),
+                } for key, bucket in self._buckets.items()
+            },
+        }
+
+
+rate_limiter = RateLimiter(RATE_LIMITS, RATE_LIMIT_SCALE)
+
+
+async def paced_goto(page, url: str, tool: str, timeout: int = 60000):
+    """经过限速器排队后打开页面，并根据响应状态、是否跳转到登录墙以及耗时调整速率
+
+    Args:
+        page: 从account_scheduler借出的标签页
+        url: 要打开的地址
+        tool: 工具名，决定令牌桶类别和排队优先级
+        timeout: page.goto的超时时间（毫秒）
+    """
+    account = account_scheduler.account_of(page)
+    keys = [("host", urlparse(url).netloc), (TOOL_RATE_CLASSES.get(tool, "read"),)]
+    if account is not None:
+        keys.append(("account", account.name))
+    waited = await rate_limiter.acquire(keys, TOOL_PRIORITIES.get(tool, 1))
+    metrics.observe("rate_wait", waited)
+    if waited >= 1:
+        logger.info("%s 限速排队 %.1f 秒后打开 %s", tool, waited, url)
+    start = time.monotonic()
+    try:
+        response = await page.goto(url, timeout=timeout)
+    except PlaywrightTimeoutError:
+        metrics.observe("goto", time.monotonic() - start)
+        metrics.incr("goto", "timeout")
+        rate_limiter.report(keys, "slow")
+        raise
+    elapsed = time.monotonic() - start
+    metrics.observe("goto", elapsed)
+    if (response is not None and response.status in RATE_BLOCKED_STATUSES) \
+            or any(marker in page.url for marker in BLOCKED_PAGE_MARKERS):
+        logger.warning("%s 打开 %s 时遇到限流或登录墙，降低请求速率", tool, url)
+        rate_limiter.report(keys, "blocked")
+        metrics.incr("goto", "blocked")
+        if account is not None and response is not None and response.status in RATE_BLOCKED_STATUSES:
+            # 登录墙和验证码页由 release_page 处理（同时作废登录状态），限流只暂停调度，不影响登录状态
+            account.quarantine(f"打开 {url} 返回限流状态码 {response.status}", ACCOUNT_THROTTLE_QUARANTINE_SECONDS)
+    elif elapsed > RATE_SLOW_RESPONSE_SECONDS:
+        rate_limiter.report(keys, "slow")
+        metrics.incr("goto", "slow")
+    else:
+        rate_limiter.report(keys, "ok")
+    return response
+
+
+def should_block_resources(tool: Optional[str], profile: Optional[str]) -> bool:
+    """启动配置开启资源拦截且该工具允许拦截时返回True"""
+    profile_conf = LAUNCH_PROFILES.get(profile or DEFAULT_LAUNCH_PROFILE, {})
+    return bool(tool and profile_conf.get("block_resources") and TOOL_RESOURCE_BLOCKING.get(tool))
+
+
+async def _block_route(route) -> None:
+    """拦截只读工具不需要的图片、视频、字体和统计请求"""
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(p in request.url for p in BLOCKED_URL_PATTERNS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+# 在页面内监听DOM变动，连续quietMs毫秒无变动视为稳定，最多等待maxMs毫秒
+DOM_STABLE_JS = '''
+    ([quietMs, maxMs]) => new Promise(resolve => {
+        let mutations = 0;
+        let quietTimer = null;
+        let hardTimer = null;
+        let observer = null;
+        const finish = (stable) => {
+            if (observer) observer.disconnect();
+            clearTimeout(quietTimer);
+            clearTimeout(hardTimer);
+            resolve({stable, mutations});
+        };
+        observer = new MutationObserver(records => {
+            mutations += records.length;
+            clearTimeout(quietTimer);
+            quietTimer = setTimeout(() => finish(true), quietMs);
+        });
+        observer.observe(document.documentElement || document, {childList: true, subtree: true, characterData: true});
+        quietTimer = setTimeout(() => finish(true), quietMs);
+        hardTimer = setTimeout(() => finish(false), maxMs);
+    })
+'''
+
+
+async def wait_for_dom_stable(page, quiet_ms: int = 500, max_ms: int = 3000) -> bool:
+    """等待DOM变动趋于稳定，返回是否在max_ms内稳定"""
+    try:
+        result = await page.evaluate(DOM_STABLE_JS, [quiet_ms, max_ms])
+        logger.debug("DOM稳定检测: %s", result)
+        return bool(result and result.get("stable"))
+    except Exception as e:
+        logger.warning("DOM稳定检测出错: %s", e)
+        return False
+
+
+async def wait_for_ready(page, selectors: List[str], timeout: float, fallback_sleep: float = 0,
+                         network_idle_timeout: float = 3, quiet_ms: int = 500) -> bool:
+    """等待页面就绪：关键选择器出现 -> 网络空闲 -> DOM稳定
+
+    所有等待共享timeout预算。选择器在预算内未出现时返回False，由调用方继续走原有的
+    提取/兜底逻辑；只有等待机制本身出错时才回退到固定的fallback_sleep。
+
+    Args:
+        page: 标签页
+        selectors: CSS选择器列表，任意一个出现即视为内容已渲染
+        timeout: 总等待预算（秒）
+        fallback_sleep: 等待机制出错时的固定等待时间（秒）
+        network_idle_timeout: 等待网络空闲的最长时间（秒）
+        quiet_ms: DOM无变动多久视为稳定（毫秒）
+    """
+    with metrics.timer("wait_ready"):
+        ready = await _wait_for_ready(page, selectors, timeout, fallback_sleep, network_idle_timeout, quiet_ms)
+    metrics.incr("ready", "ok" if ready else "timeout")
+    return ready
+
+
+async def _wait_for_ready(page, selectors: List[str], timeout: float, fallback_sleep: float,
+                          network_idle_timeout: float, quiet_ms: int) -> bool:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    try:
+        await page.wait_for_selector(", ".join(selectors), state="attached", timeout=timeout * 1000)
+    except PlaywrightTimeoutError:
+        logger.info("等待选择器超时(%ss): %s", timeout, selectors)
+        return False
+    except Exception as e:
+        logger.warning("等待页面就绪出错，回退到固定等待%ss: %s", fallback_sleep, e)
+        if fallback_sleep:
+            await asyncio.sleep(fallback_sleep)
+        return False
+    idle_budget = min(deadline - loop.time(), network_idle_timeout)
+    if idle_budget > 0.05:
+        try:
+            await page.wait_for_load_state("networkidle", timeout=idle_budget * 1000)
+        except Exception:
+            # 页面存在长连接时可能永远达不到networkidle，忽略即可
+            pass
+    remaining_ms = int((deadline - loop.time()) * 1000)
+    if remaining_ms > quiet_ms:
+        await wait_for_dom_stable(page, quiet_ms, remaining_ms)
+    return True
+
+
+# 从笔记链接中提取笔记ID，同一篇笔记的不同链接形式（explore/search_result/带参数）共用缓存
+NOTE_ID_PATTERN = re.compile(r"/(?:explore|search_result|discovery/item)/([0-9a-zA-Z]+)")
+
+
+def normalize_note_url(url: str) -> str:
+    """把笔记链接归一化为笔记ID，无法识别时去掉锚点和首尾空白后原样返回"""
+    match = NOTE_ID_PATTERN.search(url)
+    if match:
+        return match.group(1)
+    return url.split("#")[0].strip()
+
+
+# 各工具共用的数据记录。运行环境为Python 3.9，dataclass不支持slots参数，直接声明__slots__（字段不能有默认值）。
+# to_fields() 为本地笔记库和文本输出使用的中文字段，to_dict() 为结构化（json）输出使用的英文字段。
+@dataclass
+class Note:
+    __slots__ = ("url", "title", "author", "published_at", "content")
+    url: str
+    title: str
+    author: str
+    published_at: str
+    content: str
+
+    @classmethod
+    def from_fields(cls, url: str, fields: Dict[str, str]) -> "Note":
+        return cls(url, fields.get("标题") or "未知标题", fields.get("作者") or "未知作者",
+                   fields.get("发布时间") or "未知", fields.get("内容") or "未能获取内容")
+
+    @property
+    def extracted(self) -> bool:
+        """标题或正文至少有一项真正提取到（而不是默认占位值）"""
+        return self.title != "未知标题" or self.content != "未能获取内容"
 
-async def ensure_browser():
-    """确保浏览器已启动并登录，并保证context可用"""
-    global browser_context, main_page, is_logged_in
-    async with context_restart_lock:
+    def to_fields(self) -> Dict[str, str]:
+        return {"标题": self.title, "作者": self.author, "发布时间": self.published_at, "内容": self.content}
+
+    def to_dict(self) -> Dict[str, str]:
+        return asdict(self)
+
+
+@dataclass
+class SearchHit:
+    __slots__ = ("url", "title", "author", "likes")
+    url: str
+    title: str
+    author: str
+    likes: str
+
+    def to_dict(self) -> Dict[str, str]:
+        return asdict(self)
+
+
+@dataclass
+class Comment:
+    __slots__ = ("comment_id", "parent_id", "user", "content", "time", "likes")
+    comment_id: Optional[str]
+    parent_id: Optional[str]
+    user: str
+    content: str
+    time: str
+    likes: str
+
+    @classmethod
+    def from_fields(cls, fields: Dict[str, Any]) -> "Comment":
+        return cls(fields.get("评论ID"), fields.get("父评论ID"), fields.get("用户名") or "",
+                   fields.get("内容") or "", fields.get("时间") or "未知时间", fields.get("点赞数") or "0")
+
+    def to_fields(self) -> Dict[str, Any]:
+        return {"评论ID": self.comment_id, "父评论ID": self.parent_id, "用户名": self.user,
+                "内容": self.content, "时间": self.time, "点赞数": self.likes}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _record_to_json(value: Any) -> Any:
+    return asdict(value) if is_dataclass(value) else str(value)
+
+
+class ResultCache:
+    """进程内结果缓存：各工具分别设置TTL，超出条目数或字节预算时按LRU淘汰"""
+
+    def __init__(self, ttls: Dict[str, float], max_entries: int, max_bytes: int):
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size_of(value: Any) -> int:
+        if isinstance(value, str):
+            return len(value.encode("utf-8"))
+        return len(json.dumps(value, ensure_ascii=False, default=_record_to_json).encode("utf-8"))
+
+    def _remove(self, key: tuple) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, tool: str, key: Any) -> Optional[Any]:
+        """命中且未过期时返回缓存值，否则返回None"""
+        entry_key = (tool, key)
+        entry = self._entries.get(entry_key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._remove(entry_key)
+            self.misses += 1
+            metrics.incr("cache", "miss", tool=tool)
+            return None
+        self._entries.move_to_end(entry_key)
+        self.hits += 1
+        metrics.incr("cache", "hit", tool=tool)
+        return entry[2]
+
+    def put(self, tool: str, key: Any, value: Any) -> None:
+        ttl = self.ttls.get(tool)
+        if not ttl:
+            return
+        entry_key = (tool, key)
+        size = self._size_of(value)
+        if size > self.max_bytes:
+            return
+        if entry_key in self._entries:
+            self._remove(entry_key)
+        self._entries[entry_key] = (time.monotonic() + ttl, size, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, tool: str, key: Any) -> None:
+        if (tool, key) in self._entries:
+            self._remove((tool, key))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+result_cache = ResultCache(CACHE_TTLS, CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
+
+
+class NoteStore:
+    """基于SQLite的本地笔记库，保存笔记、评论和搜索结果
+
+    笔记按笔记ID upsert，记录抓取时间和内容哈希；内容哈希不变时只刷新抓取时间。
+    note_listeners 中的回调在笔记新增或内容变化时以 (旧文本或None, 新文本) 调用，文本为“标题 正文”。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.note_listeners: List[Callable[[Optional[str], str], None]] = []
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS notes (
+                note_id TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                title TEXT,
+                author TEXT,
+                publish_time TEXT,
+                content TEXT,
+                content_hash TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                changed_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS comments (
+                note_id TEXT PRIMARY KEY,
+                comments_json TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS comment_seen (
+                note_id TEXT NOT NULL,
+                comment_id TEXT NOT NULL,
+                first_seen_at REAL NOT NULL,
+                PRIMARY KEY (note_id, comment_id)
+            );
+            CREATE TABLE IF NOT EXISTS comment_cursors (
+                note_id TEXT PRIMARY KEY,
+                newest_comment_id TEXT,
+                newest_time TEXT,
+                synced_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS search_hits (
+                keyword TEXT NOT NULL,
+                note_id TEXT NOT NULL,
+                url TEXT NOT NULL,
+                title TEXT,
+                author TEXT,
+                likes TEXT,
+                rank INTEGER,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (keyword, note_id)
+            );
+        ''')
+        # 旧版本的评论表没有加载参数列，缺少时补上（旧记录的 load_info_json 为空，不会被当作满足条件的缓存）
+        comment_columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(comments)")}
+        if "load_info_json" not in comment_columns:
+            self.conn.execute("ALTER TABLE comments ADD COLUMN load_info_json TEXT")
+        self.conn.commit()
+
+    @staticmethod
+    def content_hash(value: Any) -> str:
+        return hashlib.sha1(json.dumps(value, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def upsert_note(self, note: Note) -> bool:
+        """写入笔记，返回内容相比上次是否有变化"""
+        note_id = normalize_note_url(note.url)
+        digest = self.content_hash(note.to_fields())
+        now = time.time()
+        row = self.conn.execute("SELECT content_hash, title, content FROM notes WHERE note_id = ?",
+                                (note_id,)).fetchone()
+        changed = row is None or row["content_hash"] != digest
+        self.conn.execute('''
+            INSERT INTO notes (note_id, url, title, author, publish_time, content, content_hash, fetched_at, changed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(note_id) DO UPDATE SET
+                url = excluded.url, title = excluded.title, author = excluded.author,
+                publish_time = excluded.publish_time, content = excluded.content,
+                content_hash = excluded.content_hash, fetched_at = excluded.fetched_at,
+                changed_at = CASE WHEN notes.content_hash = excluded.content_hash
+                                  THEN notes.changed_at ELSE excluded.changed_at END
+        ''', (note_id, note.url, note.title, note.author, note.published_at, note.content, digest, now, now))
+        self.conn.commit()
+        if changed:
+            old_text = f"{row['title'] or ''} {row['content'] or ''}" if row is not None else None
+            for listener in self.note_listeners:
+                listener(old_text, f"{note.title} {note.content}")
+        return changed
+
+    def get_note(self, url: str, max_age: Optional[float] = None) -> Optional[Note]:
+        """读取笔记，超过max_age秒未刷新的视为过期并返回None"""
+        row = self.conn.execute("SELECT * FROM notes WHERE note_id = ?", (normalize_note_url(url),)).fetchone()
+        if row is None or (max_age is not None and time.time() - row["fetched_at"] > max_age):
+            return None
+        return Note(url, row["title"], row["author"], row["publish_time"], row["content"])
+
+    def upsert_comments(self, url: str, comments: List[Comment], load_info: Optional[Dict[str, Any]] = None) -> None:
+        """写入评论，load_info 记录本次加载的参数和停止原因，供读取时判断是否满足新的请求"""
+        fields = [comment.to_fields() for comment in comments]
+        self.conn.execute('''
+            INSERT INTO comments (note_id, comments_json, content_hash, fetched_at, load_info_json) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(note_id) DO UPDATE SET comments_json = excluded.comments_json,
+                content_hash = excluded.content_hash, fetched_at = excluded.fetched_at,
+                load_info_json = excluded.load_info_json
+        ''', (normalize_note_url(url), json.dumps(fields, ensure_ascii=False), self.content_hash(fields), time.time(),
+              json.dumps(load_info, ensure_ascii=False) if load_info else None))
+        self.conn.commit()
+
+    def get_comments(self, url: str, max_age: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """读取评论，返回 {comments, load_info}；超过max_age秒未刷新的视为过期并返回None"""
+        row = self.conn.execute("SELECT * FROM comments WHERE note_id = ?", (normalize_note_url(url),)).fetchone()
+        if row is None or (max_age is not None and time.time() - row["fetched_at"] > max_age):
+            return None
+        return {
+            "comments": [Comment.from_fields(fields) for fields in json.loads(row["comments_json"])],
+            "load_info": json.loads(row["load_info_json"]) if row["load_info_json"] else None,
+        }
+
+    def delete_comments(self, url: str) -> None:
+        """删除笔记已保存的评论（例如发布新评论后），下次读取时重新加载"""
+        self.conn.execute("DELETE FROM comments WHERE note_id = ?", (normalize_note_url(url),))
+        self.conn.commit()
+
+    def seen_comment_ids(self, url: str) -> set:
+        """增量同步游标：该笔记已经返回过的评论ID"""
+        rows = self.conn.execute("SELECT comment_id FROM comment_seen WHERE note_id = ?",
+                                 (normalize_note_url(url),)).fetchall()
+        return {row["comment_id"] for row in rows}
+
+    def get_comment_cursor(self, url: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("SELECT * FROM comment_cursors WHERE note_id = ?", (normalize_note_url(url),)).fetchone()
+        return dict(row) if row else None
+
+    def advance_comment_cursor(self, url: str, new_comments: List[Comment]) -> None:
+        """记录本次同步新返回的评论，并把游标推进到最新一条"""
+        note_id = normalize_note_url(url)
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO comment_seen (note_id, comment_id, first_seen_at) VALUES (?, ?, ?)",
+            [(note_id, comment.comment_id, now) for comment in new_comments if comment.comment_id])
+        newest = new_comments[0] if new_comments else None
+        self.conn.execute('''
+            INSERT INTO comment_cursors (note_id, newest_comment_id, newest_time, synced_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(note_id) DO UPDATE SET
+                newest_comment_id = COALESCE(excluded.newest_comment_id, comment_cursors.newest_comment_id),
+                newest_time = COALESCE(excluded.newest_time, comment_cursors.newest_time),
+                synced_at = excluded.synced_at
+        ''', (note_id, newest.comment_id if newest else None, newest.time if newest else None, now))
+        self.conn.commit()
+
+    def upsert_search_hits(self, keyword: str, hits: List[SearchHit]) -> None:
+        now = time.time()
+        self.conn.executemany('''
+            INSERT INTO search_hits (keyword, note_id, url, title, author, likes, rank, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(keyword, note_id) DO UPDATE SET url = excluded.url, title = excluded.title,
+                author = excluded.author, likes = excluded.likes, rank = excluded.rank, fetched_at = excluded.fetched_at
+        ''', [(keyword, normalize_note_url(hit.url), hit.url, hit.title, hit.author, hit.likes, rank, now)
+              for rank, hit in enumerate(hits, 1)])
+        self.conn.commit()
+
+    def stale_note_urls(self, max_age: float, limit: int) -> List[str]:
+        """返回超过max_age秒未刷新的笔记链接，最旧的优先"""
+        rows = self.conn.execute(
+            "SELECT url FROM notes WHERE fetched_at < ? ORDER BY fetched_at LIMIT ?",
+            (time.time() - max_age, limit)).fetchall()
+        return [row["url"] for row in rows]
+
+    def iter_note_texts(self):
+        """逐条产出本地笔记的标题和正文，用于统计关键词的文档频率"""
+        for row in self.conn.execute("SELECT title, content FROM notes"):
+            yield f"{row['title'] or ''} {row['content'] or ''}"
+
+    def query_notes(self, keyword: str = "", limit: int = 20) -> List[Dict[str, Any]]:
+        """离线查询本地笔记，按标题/作者/正文模糊匹配，最近抓取的优先"""
+        pattern = f"%{keyword}%"
+        rows = self.conn.execute('''
+            SELECT note_id, url, title, author, publish_time, content, fetched_at FROM notes
+            WHERE title LIKE ? OR author LIKE ? OR content LIKE ?
+            ORDER BY fetched_at DESC LIMIT ?
+        ''', (pattern, pattern, pattern, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+
+note_store = NoteStore(NOTE_STORE_PATH)
+
+
+def format_note_content(note: Note) -> str:
+    """把笔记格式化为 get_note_content 的文本输出"""
+    return (f"标题: {note.title}\n作者: {note.author}\n发布时间: {note.published_at}\n"
+            f"链接: {note.url}\n\n内容:\n{note.content}")
+
+
+def format_search_hits(hits: List[SearchHit]) -> str:
+    """把搜索结果格式化为 search_notes 的文本输出"""
+    lines = ["搜索结果：\n"]
+    for i, hit in enumerate(hits, 1):
+        lines.append(f"{i}. {hit.title}")
+        if hit.author or hit.likes:
+            lines.append(f"   作者: {hit.author or '未知作者'} | 点赞: {hit.likes or '0'}")
+        lines.append(f"   链接: {hit.url}\n")
+    return "\n".join(lines) + "\n"
+
+
+def format_comments(comments: List[Comment], load_info: Optional[Dict[str, Any]] = None) -> str:
+    """把评论列表格式化为 get_note_comments 的文本输出"""
+    if load_info:
+        header = f"共获取到 {len(comments)} 条评论（加载 {load_info['rounds']} 轮，停止原因: {load_info['stop_reason']}）：\n"
+    else:
+        header = f"共获取到 {len(comments)} 条评论：\n"
+    lines = [header]
+    for i, comment in enumerate(comments, 1):
+        reply_mark = "↳ " if comment.parent_id else ""
+        lines.append(f"{i}. {reply_mark}{comment.user}（{comment.time}）: {comment.content}\n")
+    return "\n".join(lines) + "\n"
+
+
+class SingleFlight:
+    """请求合并：相同key的并发调用只执行一次浏览器操作，其余调用等待并共享同一结果
+
+    某个调用方被取消时共享任务继续执行；所有调用方都取消后才取消共享任务，释放标签页。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        self._waiters: Dict[tuple, int] = {}
+        self.calls: Dict[str, int] = {}
+        self.coalesced: Dict[str, int] = {}
+
+    async def do(self, key: tuple, func):
+        """执行func()，若相同key的调用正在进行则直接等待其结果
+
+        Args:
+            key: 以工具名开头的请求标识，如 ("get_note_content", 笔记ID)
+            func: 返回协程的无参函数
+        """
+        tool = key[0]
+        self.calls[tool] = self.calls.get(tool, 0) + 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._inflight.pop(key, None) if self._inflight.get(key) is done else None)
+        else:
+            self.coalesced[tool] = self.coalesced.get(tool, 0) + 1
+            metrics.incr("coalesced")
+            logger.info("合并并发请求: %s", key)
+        # shield保证某个调用方被取消时不会连带取消其他调用方共享的任务
+        self._waiters[key] = self._waiters.get(key, 0) + 1
         try:
-            if browser_context is not None:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1 and not task.done():
+                logger.info("调用方均已取消，停止任务: %s", key)
+                metrics.incr("cancelled", tool)
+                task.cancel()
+                if self._inflight.get(key) is task:
+                    del self._inflight[key]
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "inflight": len(self._inflight),
+            "calls": dict(self.calls),
+            "coalesced": dict(self.coalesced),
+        }
+
+
+single_flight = SingleFlight()
+
+
+async def ensure_browser(profile: Optional[str] = None, account: Optional[BrowserAccount] = None):
+    """确保账号的浏览器已启动并登录，并保证context可用
+
+    浏览器健康状态由close/crash事件和后台定期检查维护，健康且已登录时直接返回，不加锁；
+    只有context失效、需要切换启动配置或尚未登录时才加锁处理。
+
+    Args:
+        profile: 需要的启动配置（见 LAUNCH_PROFILES）。为None时沿用当前浏览器，
+                 首次启动使用 DEFAULT_LAUNCH_PROFILE；指定的配置与当前不同时会重启浏览器。
+        account: 要检查的账号，默认为第一个账号
+    """
+    account = account or account_scheduler.default
+    if account.is_healthy() and (not profile or profile == account.profile):
+        login_state = account.cached_login_state()
+        if login_state is not None:
+            metrics.incr("ensure_browser", "fast_path")
+            return login_state
+    metrics.incr("ensure_browser", "locked")
+    with metrics.timer("ensure_browser"):
+        return await _ensure_browser_locked(profile, account)
+
+
+async def _ensure_browser_locked(profile: Optional[str], account: BrowserAccount) -> bool:
+    global playwright_instance
+    async with account.restart_lock:
+        if account.context is not None and account.context_closed:
+            account.context = None
+
+        if account.context is not None and profile and profile != account.profile:
+            # 持久化目录同一时间只能被一个浏览器使用，切换配置需先关闭当前浏览器
+            logger.info("账号 %s 切换浏览器启动配置: %s -> %s", account.name, account.profile, profile)
+            try:
+                await account.context.close()
+            except Exception as e:
+                logger.warning("关闭浏览器出错: %s", e)
+            account.context = None
+
+        if account.context is not None and (account.main_page is None or account.main_page_crashed
+                                            or account.main_page.is_closed()):
+            # context仍在，只需重新打开主标签页；打不开说明context已失效，关闭后重启
+            logger.info("账号 %s 重新打开主标签页", account.name)
+            try:
+                if account.main_page is not None and not account.main_page.is_closed():
+                    await account.main_page.close()
+                account.main_page = await account.context.new_page()
+                account.main_page.set_default_timeout(60000)
+                account.main_page.on("crash", account.on_main_page_crash)
+                account.main_page_crashed = False
+            except Exception as e:
+                logger.warning("账号 %s 浏览器已失效，准备重启: %s", account.name, e)
                 try:
-                    page = await browser_context.new_page()
-                    await page.close()
+                    await account.context.close()
                 except Exception:
-                    browser_context = None  # context已失效，需重启
-        except Exception:
-            browser_context = None
-
-        if browser_context is None:
-            playwright_instance = await async_playwright().start()
-            browser_context = await playwright_instance.chromium.launch_persistent_context(
-                user_data_dir=BROWSER_DATA_DIR,
-                headless=False,  # 非隐藏模式，方便用户登录
-                viewport={"width": 1280, "height": 800},
-                timeout=60000
-            )
+                    pass
+                account.context = None
+
+        if account.context is None:
+            account.profile = profile or account.profile or DEFAULT_LAUNCH_PROFILE
+            if playwright_instance is None:
+                playwright_instance = await async_playwright().start()
+            with metrics.timer("launch_browser"):
+                account.context = await playwright_instance.chromium.launch_persistent_context(
+                    user_data_dir=account.user_data_dir,
+                    headless=LAUNCH_PROFILES[account.profile]["headless"],
+                    viewport={"width": 1280, "height": 800},
+                    timeout=60000
+                )
+            logger.info("账号 %s 浏览器已启动，启动配置: %s", account.name, account.profile)
+            account.context_closed = False
+            account.context.on("close", account.on_context_close)
+            account.page_pool.reset()
             # 只保留main_page，其余全部关闭
-            if browser_context.pages:
-                main_page = browser_context.pages[0]
+            if account.context.pages:
+                account.main_page = account.context.pages[0]
                 # 关闭多余标签页
-                for p in browser_context.pages[1:]:
+                for p in account.context.pages[1:]:
                     try:
                         await p.close()
                     except Exception as e:
-                        logging.warning(f"关闭多余标签页出错: {e}")
-            else:
-                main_page = await browser_context.new_page()
-            main_page.set_default_timeout(60000)
-            is_logged_in = False  # 新context需重新判断登录
-        # 检查登录状态
-        if not is_logged_in:
-            # 只在首次启动时goto主页
-            await main_page.goto("https://www.xiaohongshu.com", timeout=60000)
-            await asyncio.sleep(3)
-            login_elements = await main_page.query_selector_all('text="登录"')
-            if login_elements:
-                return False  # 需要登录
+                        logger.warning("关闭多余标签页出错: %s", e)
             else:
-                is_logged_in = True
-                return True  # 已登录
-        return True
+                account.main_page = await account.context.new_page()
+            account.main_page.set_default_timeout(60000)
+            account.main_page.on("crash", account.on_main_page_crash)
+            account.main_page_crashed = False
+            account.login_checked_at = None  # 新context需重新判断登录
+            account.start_health_monitor()
+        # 登录状态缓存过期或新context时重新检查
+        login_state = account.cached_login_state()
+        if login_state is None:
+            with metrics.timer("login_check"):
+                login_state = await account.refresh_login_state()
+        return login_state
 
 @mcp.tool()
-async def login() -> str:
-    """登录小红书账号"""
-    global is_logged_in
-    
-    await ensure_browser()
+@instrumented
+async def login(account: str = "") -> str:
+    """登录小红书账号
+
+    Args:
+        account: 要登录的账号名（配置了多账号 XHS_ACCOUNTS 时使用），默认为第一个账号
+    """
+    target = account_scheduler.get(account) if account else account_scheduler.default
+    if target is None:
+        return f"未找到账号: {account}"
     
-    if is_logged_in:
+    # 先用当前的浏览器检查登录状态，已登录时不必切换到有界面的配置
+    if await ensure_browser(account=target):
+        target.release_quarantine()
+        return "已登录小红书账号"
+
+    # 扫码登录需要有界面的浏览器
+    if await ensure_browser("login", account=target):
+        target.release_quarantine()
+        await restore_launch_profile(target)
         return "已登录小红书账号"
     
     # 访问小红书登录页面
-    await main_page.goto("https://www.xiaohongshu.com", timeout=60000)
+    main_page = target.main_page
+    await main_page.goto(BASE_URL, timeout=60000)
     await asyncio.sleep(3)
     
     # 查找登录按钮并点击
     login_elements = await main_page.query_selector_all('text="登录"')
     if login_elements:
+        # 记下访客会话值，扫码登录后会话cookie变化才算登录成功
+        target.guest_session = await target.session_cookie() or ""
         await login_elements[0].click()
         
         # 提示用户手动登录
@@ -100,15 +1618,15 @@ async def login() -> str:
         
         # 等待用户登录成功
         max_wait_time = 180  # 等待3分钟
-        wait_interval = 5
+        wait_interval = 2
         waited_time = 0
         
         while waited_time < max_wait_time:
-            # 检查是否已登录成功
-            still_login = await main_page.query_selector_all('text="登录"')
-            if not still_login:
-                is_logged_in = True
+            # 检查是否已登录成功：只读取会话cookie，不刷新登录弹窗
+            if await target.refresh_login_state(probe=False):
+                target.release_quarantine()
                 await asyncio.sleep(2)  # 等待页面加载
+                await restore_launch_profile(target)
                 return "登录成功！"
             
             # 继续等待
@@ -117,544 +1635,1209 @@ async def login() -> str:
         
         return "登录等待超时。请重试或手动登录后再使用其他功能。"
     else:
-        is_logged_in = True
+        target.confirm_session(await target.session_cookie())
+        target.set_login_state(True)
+        target.release_quarantine()
+        await restore_launch_profile(target)
         return "已登录小红书账号"
 
-@mcp.tool()
-async def search_notes(keywords: str, limit: int = 5) -> str:
-    """根据关键词搜索笔记
-    
-    Args:
-        keywords: 搜索关键词
-        limit: 返回结果数量限制
+
+async def restore_launch_profile(account: BrowserAccount) -> None:
+    """登录完成后切回默认启动配置（如 XHS_LAUNCH_PROFILE=scrape 时的无界面浏览器），登录状态保存在用户数据目录中"""
+    if account.profile == DEFAULT_LAUNCH_PROFILE:
+        return
+    # 登录成功时已记下确认的会话，重启后的登录检查直接比对会话cookie，不需要打开首页
+    try:
+        await ensure_browser(DEFAULT_LAUNCH_PROFILE, account=account)
+    except Exception as e:
+        logger.warning("账号 %s 切回启动配置 %s 失败: %s", account.name, DEFAULT_LAUNCH_PROFILE, e)
+
+# 页面加载数据时调用的接口，按路径片段匹配
+API_PATTERNS = {
+    "search": "/api/sns/web/v1/search/notes",
+    "note": "/api/sns/web/v1/feed",
+    "comments": "/api/sns/web/v2/comment/page",
+    "replies": "/api/sns/web/v2/comment/sub/page",  # 点击“展开回复”加载的楼中楼回复
+}
+
+
+def _format_timestamp(ms: Any) -> str:
+    """接口中的毫秒时间戳转为日期字符串"""
+    try:
+        return datetime.fromtimestamp(int(ms) / 1000).strftime("%Y-%m-%d %H:%M")
+    except (TypeError, ValueError, OverflowError, OSError):
+        return ""
+
+
+def parse_search_payload(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """把搜索接口数据解析为与 extract_search_cards 相同结构的卡片记录"""
+    cards = []
+    for item in (payload.get("data") or {}).get("items") or []:
+        note_card = item.get("note_card") or {}
+        note_id = item.get("id")
+        if not note_id or item.get("model_type", "note") != "note":
+            continue
+        href = f"/search_result/{note_id}"
+        if item.get("xsec_token"):
+            href += f"?xsec_token={item['xsec_token']}&xsec_source="
+        title = (note_card.get("display_title") or note_card.get("title") or "").strip()
+        cards.append({
+            "href": href,
+            "title": title or "未知标题",
+            "title_method": "api" if title else None,
+            "author": ((note_card.get("user") or {}).get("nickname") or "").strip(),
+            "likes": str((note_card.get("interact_info") or {}).get("liked_count") or ""),
+        })
+    return cards
+
+
+def parse_note_payload(payload: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """把笔记详情接口数据解析为 get_note_content 使用的字段字典"""
+    items = (payload.get("data") or {}).get("items") or []
+    if not items:
+        return None
+    note_card = items[0].get("note_card") or {}
+    if not note_card:
+        return None
+    publish_time = _format_timestamp(note_card.get("time"))
+    if note_card.get("ip_location") and publish_time:
+        publish_time = f"{publish_time} {note_card['ip_location']}"
+    return {
+        "标题": (note_card.get("title") or "").strip() or "未知标题",
+        "作者": ((note_card.get("user") or {}).get("nickname") or "").strip() or "未知作者",
+        "发布时间": publish_time or "未知",
+        "内容": (note_card.get("desc") or "").strip() or "未能获取内容",
+    }
+
+
+def parse_comment_payloads(payloads: List[Dict[str, Any]],
+                           reply_payloads: Optional[List[Dict[str, Any]]] = None) -> List[Comment]:
+    """把多页评论接口数据合并解析为评论列表（含楼中楼回复），按评论ID去重
+
+    Args:
+        payloads: 评论分页接口数据
+        reply_payloads: 展开回复接口数据，其中的回复挂在 root_comment_id 对应的一级评论下
+    """
+    comments = []
+    seen_ids = set()
+
+    def add(raw: Dict[str, Any], parent_id: Optional[str] = None) -> None:
+        comment_id = raw.get("id")
+        if comment_id in seen_ids:
+            return
+        seen_ids.add(comment_id)
+        content = (raw.get("content") or "").strip()
+        username = ((raw.get("user_info") or {}).get("nickname") or "").strip()
+        if not content or not username:
+            return
+        time_location = " ".join(filter(None, [_format_timestamp(raw.get("create_time")), raw.get("ip_location")]))
+        comments.append(Comment(comment_id, parent_id, username, content, time_location or "未知时间",
+                                str(raw.get("like_count") or "0")))
+
+    for payload in payloads:
+        for raw in (payload.get("data") or {}).get("comments") or []:
+            add(raw)
+            for sub in raw.get("sub_comments") or []:
+                add(sub, raw.get("id"))
+    for payload in reply_payloads or []:
+        for raw in (payload.get("data") or {}).get("comments") or []:
+            add(raw, payload.get("root_comment_id"))
+    return comments
+
+
+class ResponseCapture:
+    """监听标签页的接口响应，收集与 API_PATTERNS 匹配的JSON数据
+
+    attach() 需在 page.goto 之前调用，使用完毕后必须 detach()，
+    避免监听器随标签页回到池中被下一个调用继承。
+    """
+
+    def __init__(self, page, kinds: List[str]):
+        self.page = page
+        self.kinds = kinds
+        self.payloads: Dict[str, List[Dict[str, Any]]] = {kind: [] for kind in kinds}
+        self._events = {kind: asyncio.Event() for kind in kinds}
+
+    async def _on_response(self, response) -> None:
+        for kind in self.kinds:
+            if API_PATTERNS[kind] not in response.url:
+                continue
+            try:
+                payload = await response.json()
+            except Exception as e:
+                logger.info("解析接口响应失败(%s): %s", kind, e)
+                return
+            if isinstance(payload, dict) and payload.get("success", True):
+                if kind == "replies":
+                    # 回复接口的数据里没有所属的一级评论ID，从请求参数中取出
+                    query = parse_qs(urlparse(response.url).query)
+                    payload["root_comment_id"] = (query.get("root_comment_id") or [None])[0]
+                self.payloads[kind].append(payload)
+                self._events[kind].set()
+            return
+
+    def attach(self) -> "ResponseCapture":
+        self.page.on("response", self._on_response)
+        return self
+
+    def detach(self) -> None:
+        try:
+            self.page.remove_listener("response", self._on_response)
+        except Exception:
+            pass
+
+    async def wait_for(self, kind: str, timeout: float = NETWORK_CAPTURE_TIMEOUT) -> bool:
+        """等待某类接口响应到达，超时返回False"""
+        try:
+            with metrics.timer("capture_wait"):
+                await asyncio.wait_for(self._events[kind].wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.info("未捕获到%s接口响应，回退到DOM解析", kind)
+            return False
+
+    async def wait_for_new(self, kind: str, seen_count: int, timeout: float = NETWORK_CAPTURE_TIMEOUT) -> bool:
+        """等待该类接口的响应数超过seen_count（例如滚动触发的下一页），超时返回False"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while len(self.payloads[kind]) <= seen_count:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            self._events[kind].clear()
+            try:
+                await asyncio.wait_for(self._events[kind].wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def has_more(self, kind: str) -> bool:
+        """最近一页接口数据是否还有更多内容"""
+        if not self.payloads[kind]:
+            return True
+        return bool((self.payloads[kind][-1].get("data") or {}).get("has_more", False))
+
+
+def start_capture(page, kinds: List[str]) -> Optional[ResponseCapture]:
+    """按配置为标签页开启网络捕获，未启用时返回None"""
+    if not NETWORK_CAPTURE_ENABLED:
+        return None
+    return ResponseCapture(page, kinds).attach()
+
+
+async def wait_capture_or_ready(page, capture: Optional[ResponseCapture], kind: str, selectors: List[str],
+                                timeout: float, fallback_sleep: float = 0) -> bool:
+    """同时等待接口响应和页面就绪，先到者胜出
+
+    接口数据先到时立即返回True（不再等待页面就绪）；页面先就绪或接口等待超时时，
+    等页面就绪后返回接口数据是否已经到达。返回False时页面已按wait_for_ready等待过，调用方可直接走DOM解析。
+
+    Args:
+        page: 标签页
+        capture: 网络捕获，None时只等待页面就绪
+        kind: 接口类别，见 API_PATTERNS
+        selectors: 页面就绪的关键选择器
+        timeout: 页面就绪的等待预算（秒）
+        fallback_sleep: 等待机制出错时的固定等待时间（秒）
+    """
+    if not capture:
+        await wait_for_ready(page, selectors, timeout, fallback_sleep=fallback_sleep)
+        return False
+    capture_task = asyncio.ensure_future(capture.wait_for(kind))
+    ready_task = asyncio.ensure_future(wait_for_ready(page, selectors, timeout, fallback_sleep=fallback_sleep))
+    pending = {capture_task, ready_task}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if capture_task in done and capture_task.result():
+                return True
+            if ready_task in done:
+                return bool(capture.payloads[kind])
+        return False
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+# 搜索结果卡片的页面内批量提取：一次evaluate返回所有卡片的链接/标题/作者/点赞数，
+# 标题沿用原有的四种兜底方法，并记录命中的方法编号
+SEARCH_CARD_SELECTORS = ['section.note-item', 'div[data-v-a264b01a]']
+NOTE_READY_SELECTORS = ['#detail-title', '#detail-desc', '.note-content']
+
+SEARCH_CARDS_JS = '''
+    (cardSelectors) => {
+        const textOf = el => (el && el.textContent ? el.textContent.trim() : '');
+        let cards = [];
+        for (const selector of cardSelectors) {
+            cards = Array.from(document.querySelectorAll(selector));
+            if (cards.length) break;
+        }
+        const longest = texts => texts.reduce((a, b) => (b.length > a.length ? b : a), '');
+        const records = [];
+        for (const card of cards) {
+            const link = card.querySelector('a[href*="/search_result/"]');
+            const href = link ? link.getAttribute('href') : null;
+            if (!href || !href.includes('/search_result/')) continue;
+            let title = '';
+            let titleMethod = null;
+            const title1 = card.querySelector('div.footer a.title span');
+            const title2 = title1 ? null : card.querySelector('a.title span');
+            if (title1) {
+                title = textOf(title1);
+                titleMethod = 1;
+            } else if (title2) {
+                title = textOf(title2);
+                titleMethod = 2;
+            } else {
+                const spanTexts = Array.from(card.querySelectorAll('span')).map(textOf).filter(t => t.length > 5);
+                if (spanTexts.length) {
+                    title = longest(spanTexts);
+                    titleMethod = 3;
+                } else {
+                    const allTexts = Array.from(card.querySelectorAll('*')).map(textOf).filter(t => t.length > 5);
+                    if (allTexts.length) {
+                        title = longest(allTexts);
+                        titleMethod = 4;
+                    }
+                }
+            }
+            const author = card.querySelector('.author .name, .author-wrapper .name, a.author span.name');
+            const likes = card.querySelector('.like-wrapper .count, .footer .count');
+            records.push({
+                href,
+                title: title || '未知标题',
+                title_method: title ? titleMethod : null,
+                author: textOf(author),
+                likes: textOf(likes),
+            });
+        }
+        return records;
+    }
+'''
+
+
+async def extract_search_cards(page) -> List[Dict[str, Any]]:
+    """在页面内一次性提取搜索结果卡片，耗时不随卡片数量增加IPC调用次数"""
+    with metrics.timer("extract_cards"):
+        return await page.evaluate(SEARCH_CARDS_JS, SEARCH_CARD_SELECTORS)
+
+
+async def iter_search_posts(page, capture: Optional[ResponseCapture], seen_urls: set, limit: int,
+                            scroll_budget: float = 0):
+    """逐批产出搜索页中新出现的笔记，直到凑够limit条
+
+    首屏结果产出后，若scroll_budget>0则继续滚动加载下一页，直到凑够limit条、
+    超出时间预算或连续 SEARCH_SCROLL_IDLE_ROUNDS 轮没有新笔记。
+    接口数据表明没有下一页时立即结束，不再空等滚动。
+    seen_urls 记录已产出笔记的归一化ID（normalize_note_url），跨批次去重。
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + scroll_budget
+    found = 0
+    payload_count = 0
+
+    def take(cards: List[Dict[str, Any]]) -> List[SearchHit]:
+        nonlocal found
+        chunk = []
+        for card in cards:
+            if found >= limit:
+                break
+            url = f"{BASE_URL}{card['href']}"
+            # 同一笔记在接口和DOM中的链接形式可能不同（带xsec_token等参数），按笔记ID去重
+            note_key = normalize_note_url(url)
+            if note_key in seen_urls:
+                continue
+            seen_urls.add(note_key)
+            metrics.incr("title_method", str(card["title_method"] or "none"))
+            if card["title_method"]:
+                search_logger.debug("找到标题(方法%s): %s", card["title_method"], card["title"])
+            else:
+                search_logger.debug("无法找到标题，使用默认值'未知标题'")
+            chunk.append(SearchHit(url, card["title"], card["author"], card["likes"]))
+            found += 1
+        return chunk
+
+    def new_payload_cards() -> List[Dict[str, Any]]:
+        nonlocal payload_count
+        payloads = capture.payloads["search"][payload_count:]
+        payload_count += len(payloads)
+        return [card for payload in payloads for card in parse_search_payload(payload)]
+
+    cards = []
+    captured = await wait_capture_or_ready(page, capture, "search", SEARCH_CARD_SELECTORS,
+                                           READY_TIMEOUTS["search_notes"], fallback_sleep=10)
+    if captured:
+        cards = new_payload_cards()
+        search_logger.info("从搜索接口解析到 %s 个帖子", len(cards))
+        metrics.incr("source", "capture")
+    if not cards:
+        if captured:
+            # 接口数据先到但解析不出卡片，页面还没有等待过
+            await wait_for_ready(page, SEARCH_CARD_SELECTORS, READY_TIMEOUTS["search_notes"], fallback_sleep=10)
+        await debug_dump_html(page, search_logger, "搜索结果页")
+        search_logger.debug("尝试获取帖子卡片...")
+        cards = await extract_search_cards(page)
+        metrics.incr("source", "dom")
+    search_logger.info("找到 %s 个帖子卡片", len(cards))
+    chunk = take(cards)
+    if chunk:
+        yield chunk
+
+    idle_rounds = 0
+    while found < limit and loop.time() < deadline and idle_rounds < SEARCH_SCROLL_IDLE_ROUNDS:
+        if capture and not capture.has_more("search"):
+            search_logger.info("搜索接口显示没有更多结果，停止滚动加载")
+            break
+        await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+        remaining = max(deadline - loop.time(), 0)
+        cards = []
+        if capture and await capture.wait_for_new("search", payload_count, timeout=min(remaining, NETWORK_CAPTURE_TIMEOUT)):
+            cards = new_payload_cards()
+        if not cards:
+            await wait_for_dom_stable(page, quiet_ms=300, max_ms=int(min(remaining, 3) * 1000))
+            cards = await extract_search_cards(page)
+        chunk = take(cards)
+        if chunk:
+            idle_rounds = 0
+            search_logger.info("滚动加载到 %s 条新笔记，累计 %s/%s", len(chunk), found, limit)
+            yield chunk
+        else:
+            idle_rounds += 1
+
+
+@mcp.tool()
+@instrumented
+async def search_notes(keywords: str, limit: int = 5, use_cache: bool = True, paginate: bool = True,
+                       time_budget: float = SEARCH_SCROLL_BUDGET, output_format: str = "text",
+                       ctx: Context = None) -> Union[str, dict]:
+    """根据关键词搜索笔记
+    
+    Args:
+        keywords: 搜索关键词
+        limit: 返回结果数量限制
+        use_cache: 是否使用缓存结果，传False强制重新搜索
+        paginate: 首屏结果不足limit条时是否继续滚动加载
+        time_budget: 滚动加载的时间预算（秒）
+        output_format: 输出格式，"text" 为文本，"json" 为结构化结果 {keywords, count, notes}
+        ctx: MCP上下文，由框架注入；客户端请求进度时，每加载到一批笔记就通过进度通知发送这一批结果
+    """
+    hits = await load_search_hits(keywords, limit, use_cache, paginate, time_budget)
+    if output_format == "json":
+        if isinstance(hits, str):
+            return {"error": hits}
+        return {"keywords": keywords, "count": len(hits), "notes": [hit.to_dict() for hit in hits]}
+    if isinstance(hits, str):
+        return hits
+    return format_search_hits(hits) if hits else f"未找到与\"{keywords}\"相关的笔记"
+
+
+async def load_search_hits(keywords: str, limit: int = 5, use_cache: bool = True, paginate: bool = True,
+                           time_budget: float = SEARCH_SCROLL_BUDGET) -> Union[List[SearchHit], str]:
+    """返回搜索结果记录列表，出错时返回错误信息"""
+    cache_key = (keywords.strip(), limit, paginate)
+    if use_cache:
+        cached = result_cache.get("search_notes", cache_key)
+        if cached is not None:
+            return cached
+    return await single_flight.do(("search_notes",) + cache_key, lambda: _search_notes(keywords, limit, cache_key, time_budget if paginate else 0))
+
+
+async def _search_notes(keywords: str, limit: int, cache_key: tuple, scroll_budget: float) -> Union[List[SearchHit], str]:
+    """打开搜索页并提取结果，相同关键词的并发调用由single_flight合并为一次"""
+    for attempt in range(2):
+        try:
+            page = await account_scheduler.acquire_page("search_notes")
+            if page is None:
+                return "请先登录小红书账号"
+            search_logger.debug("借出标签页: %s, tool: search_notes, keywords: %s", page, keywords)
+            capture = start_capture(page, ["search"])
+            try:
+                search_url = f"{BASE_URL}/search_result?keyword={keywords}"
+                search_logger.debug("search_notes: page.goto(%s) 开始", search_url)
+                await paced_goto(page, search_url, "search_notes")
+                search_logger.debug("search_notes: page.goto(%s) 完成", search_url)
+                hits = []
+                async for chunk in iter_search_posts(page, capture, set(), limit, scroll_budget):
+                    hits.extend(chunk)
+                    await report_progress(len(hits), limit, f"已找到 {len(hits)}/{limit} 条笔记，本批: "
+                                          + json.dumps([hit.to_dict() for hit in chunk], ensure_ascii=False))
+                if hits:
+                    note_store.upsert_search_hits(keywords.strip(), hits)
+                    result_cache.put("search_notes", cache_key, hits)
+                return hits
+            finally:
+                if capture:
+                    capture.detach()
+                search_logger.debug("search_notes: 归还标签页: %s", page)
+                await account_scheduler.release_page(page)
+        except Exception as e:
+            if attempt == 0 and ("context" in str(e).lower() or "browser has been closed" in str(e).lower() or "Target page" in str(e)):
+                metrics.incr("retry")
+                continue
+            return f"搜索笔记时出错: {str(e)}"
+
+class SelectorRegistry:
+    """记录各字段每种提取策略（选择器或兜底方法）的成功率和耗时，按历史表现决定下次的尝试顺序
+
+    每个策略以 [成功次数, 尝试次数, 累计耗时毫秒] 记录，每次记录前按 SELECTOR_STATS_DECAY 衰减，
+    使近期表现占主导。平滑后的成功率不低于 SELECTOR_DEMOTE_RATE 的策略保持规则中的原始顺序，
+    只有低于该值（近期经常失败）的策略被降到后面，降级策略之间按成功率、平均耗时排序；
+    没有记录的策略按成功率0.5计算。统计定期写入 SELECTOR_STATS_PATH，重启后沿用。
+    """
+
+    def __init__(self, path: str, decay: float = SELECTOR_STATS_DECAY, enabled: bool = ADAPTIVE_SELECTORS_ENABLED):
+        self.path = path
+        self.decay = decay
+        self.enabled = enabled
+        self.stats_by_field: Dict[str, Dict[str, List[float]]] = self._load()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._calls: Counter = Counter()
+
+    def _load(self) -> Dict[str, Dict[str, List[float]]]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            return {str(field): {str(key): [float(v) for v in entry[:3]] for key, entry in entries.items()}
+                    for field, entries in data.items()}
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logger.warning("选择器统计 %s 读取失败，重新开始统计: %s", self.path, e)
+            return {}
+
+    def save(self, force: bool = False) -> None:
+        """写入统计文件，未到 SELECTOR_STATS_SAVE_INTERVAL 时跳过（force=True 除外）"""
+        if not self._dirty or (not force and time.monotonic() - self._saved_at < SELECTOR_STATS_SAVE_INTERVAL):
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.stats_by_field, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+        except OSError as e:
+            logger.warning("选择器统计写入失败: %s", e)
+
+    def _score(self, field: str, key: str, index: int) -> tuple:
+        successes, attempts, total_ms = self.stats_by_field.get(field, {}).get(key, (0.0, 0.0, 0.0))
+        rate = (successes + 1) / (attempts + 2)
+        if rate >= SELECTOR_DEMOTE_RATE:
+            # 仍然有效的策略保持规则中的顺序，靠后的宽松兜底方法不会因为更快而排到精确选择器前面
+            return (0, 0.0, 0.0, index)
+        mean_ms = total_ms / attempts if attempts else 0.0
+        return (1, -rate, mean_ms, index)
+
+    def _rank(self, field: str, keys: List[str]) -> List[int]:
+        return sorted(range(len(keys)), key=lambda index: self._score(field, keys[index], index))
+
+    def order(self, field: str, keys: List[str]) -> List[int]:
+        """返回 keys 的下标，按应尝试的先后排列；未启用时或每 SELECTOR_PROBE_INTERVAL 次调用保持原始顺序"""
+        if not self.enabled:
+            return list(range(len(keys)))
+        self._calls[field] += 1
+        if self._calls[field] % SELECTOR_PROBE_INTERVAL == 0:
+            # 定期按原始顺序重新尝试，让被降级的精确选择器在页面恢复后有机会重新记录成功
+            return list(range(len(keys)))
+        return self._rank(field, keys)
+
+    def ordered(self, field: str, items: List[Any], key=lambda item: item) -> List[Any]:
+        """按历史表现重排 items，key 从元素中取出策略标识"""
+        keys = [key(item) for item in items]
+        return [items[index] for index in self.order(field, keys)]
+
+    def record(self, field: str, key: str, success: bool, seconds: float = 0.0) -> None:
+        entries = self.stats_by_field.setdefault(field, {})
+        for entry in entries.values():
+            entry[0] *= self.decay
+            entry[1] *= self.decay
+            entry[2] *= self.decay
+        entry = entries.setdefault(key, [0.0, 0.0, 0.0])
+        entry[0] += 1 if success else 0
+        entry[1] += 1
+        entry[2] += seconds * 1000
+        self._dirty = True
+        self.save()
+
+    def stats(self) -> Dict[str, List[Dict[str, Any]]]:
+        """各字段策略的当前排序及衰减后的成功率、平均耗时（毫秒）"""
+        result = {}
+        for field, entries in self.stats_by_field.items():
+            keys = list(entries)
+            rows = []
+            for index in self._rank(field, keys):
+                successes, attempts, total_ms = entries[keys[index]]
+                rows.append({
+                    "strategy": keys[index],
+                    "success_rate": round(successes / attempts, 3) if attempts else None,
+                    "weight": round(attempts, 2),
+                    "mean_ms": round(total_ms / attempts, 2) if attempts else None,
+                })
+            result[field] = rows
+        return result
+
+
+selector_registry = SelectorRegistry(SELECTOR_STATS_PATH)
+
+
+# 笔记详情字段提取规则：每个字段按顺序尝试各个方法，第一个取到有效文本的方法胜出。
+# 所有方法在页面内通过一次 page.evaluate 执行，避免逐个选择器来回调用。
+NOTE_COMMENT_AREA_SELECTOR = '.comments-container, .comment-list, .feed-comment, div[data-v-aed4aacc], .comment-item'
+
+NOTE_EXTRACTION_SPEC = {
+    "comment_selector": NOTE_COMMENT_AREA_SELECTOR,
+    "fields": {
+        "标题": {
+            "default": "未知标题",
+            "strategies": [
+                {"method": "方法1", "type": "selector", "selectors": ["#detail-title"]},
+                {"method": "方法2", "type": "selector", "selectors": ["div.title"]},
+                {"method": "方法3", "type": "selector", "selectors": ["h1", "div.note-content div.title"]},
+            ],
+        },
+        "作者": {
+            "default": "未知作者",
+            "strategies": [
+                {"method": "方法1", "type": "selector", "selectors": ["span.username"]},
+                {"method": "方法2", "type": "selector", "selectors": ["a.name"]},
+                {"method": "方法3", "type": "selector", "selectors": [".author-wrapper .username", ".info .name"]},
+            ],
+        },
+        "发布时间": {
+            "default": "未知",
+            "strategies": [
+                {"method": "方法1", "type": "selector", "selectors": ["span.date"]},
+                {"method": "方法2", "type": "text_regex",
+                 "patterns": [r"编辑于", r"\d{2}-\d{2}", r"\d{4}-\d{2}-\d{2}", r"\d+月\d+日",
+                              r"\d+天前", r"\d+小时前", r"今天", r"昨天"]},
+                {"method": "方法3", "type": "selector", "selectors": [".bottom-container .date", ".date"]},
+                {"method": "方法3", "type": "body_regex",
+                 "patterns": [r"编辑于\s*([\d-]+)", r"(\d{2}-\d{2})", r"(\d{4}-\d{2}-\d{2})", r"(\d+月\d+日)",
+                              r"(\d+天前)", r"(\d+小时前)", r"(今天)", r"(昨天)"]},
+            ],
+        },
+        "内容": {
+            "default": "未能获取内容",
+            "strategies": [
+                {"method": "方法1", "type": "selector", "selectors": ["#detail-desc .note-text"],
+                 "exclude_comments": True, "min_length": 51},
+                {"method": "方法2", "type": "xpath", "xpath": '//div[@id="detail-desc"]/span[@class="note-text"]',
+                 "min_length": 21},
+                {"method": "方法3", "type": "longest",
+                 "selectors": ["div#detail-desc", "div.note-content", "div.desc", "span.note-text"],
+                 "exclude_comments": True, "min_length": 101, "max_length": 9999},
+                {"method": "方法4", "type": "selector", "selectors": [".note-content .note-text", ".note-content"],
+                 "min_length": 51},
+                {"method": "方法4", "type": "paragraphs", "exclude_comments": True, "min_length": 51},
+                {"method": "方法5", "type": "selector",
+                 "selectors": ["div.note-content #detail-desc span.note-text", "div.note-content #detail-desc"],
+                 "min_length": 101},
+                {"method": "方法5", "type": "selector", "selectors": ["div.desc"], "all": True,
+                 "exclude_comments": True, "min_length": 101},
+            ],
+        },
+    },
+}
+
+NOTE_EXTRACT_JS = '''
+    (spec) => {
+        const inComment = el => !!(spec.comment_selector && el.closest(spec.comment_selector));
+        const textOf = el => (el && el.textContent ? el.textContent.trim() : '');
+        const accept = (text, s) => !!text && text.length >= (s.min_length || 1)
+            && (!s.max_length || text.length <= s.max_length);
+        const runners = {
+            selector(s) {
+                for (const sel of s.selectors) {
+                    const elements = s.all ? Array.from(document.querySelectorAll(sel))
+                        : [document.querySelector(sel)].filter(Boolean);
+                    for (const el of elements) {
+                        if (s.exclude_comments && inComment(el)) continue;
+                        const text = textOf(el);
+                        if (accept(text, s)) return text;
+                    }
+                }
+                return null;
+            },
+            xpath(s) {
+                const node = document.evaluate(s.xpath, document, null,
+                    XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+                const text = textOf(node);
+                return accept(text, s) ? text : null;
+            },
+            longest(s) {
+                const texts = Array.from(document.querySelectorAll(s.selectors.join(', ')))
+                    .filter(el => !(s.exclude_comments && inComment(el)))
+                    .map(textOf)
+                    .filter(text => accept(text, s))
+                    .sort((a, b) => b.length - a.length);
+                return texts.length ? texts[0] : null;
+            },
+            paragraphs(s) {
+                const parts = Array.from(document.querySelectorAll('p'))
+                    .filter(p => !(s.exclude_comments && inComment(p)))
+                    .map(textOf)
+                    .filter(text => text.length > 10);
+                const text = parts.join('\\n\\n');
+                return parts.length && accept(text, s) ? text : null;
+            },
+            text_regex(s) {
+                // 与 Playwright 的 text=/.../ 选择器等价：返回第一个文本匹配的元素的文本
+                for (const pattern of s.patterns) {
+                    const re = new RegExp(pattern);
+                    const walker = document.createTreeWalker(document.body, NodeFilter.SHOW_TEXT);
+                    let node;
+                    while ((node = walker.nextNode())) {
+                        const parent = node.parentElement;
+                        if (!parent || ['SCRIPT', 'STYLE'].includes(parent.tagName)) continue;
+                        if (re.test(node.data)) {
+                            const text = textOf(parent);
+                            if (accept(text, s)) return text;
+                        }
+                    }
+                }
+                return null;
+            },
+            body_regex(s) {
+                const allText = document.body ? document.body.textContent : '';
+                for (const pattern of s.patterns) {
+                    const match = allText.match(new RegExp(pattern));
+                    if (match) return match[0];
+                }
+                return null;
+            }
+        };
+        const fields = {};
+        const matched = {};
+        const attempts = {};
+        for (const [field, conf] of Object.entries(spec.fields)) {
+            fields[field] = conf.default;
+            matched[field] = null;
+            attempts[field] = [];
+            for (const s of conf.strategies) {
+                let value = null;
+                const started = performance.now();
+                try {
+                    value = runners[s.type](s);
+                } catch (e) {
+                    value = null;
+                }
+                attempts[field].push([s.key, !!value, performance.now() - started]);
+                if (value) {
+                    fields[field] = value;
+                    matched[field] = s.method;
+                    break;
+                }
+            }
+        }
+        return {fields, matched, attempts};
+    }
+'''
+
+
+def strategy_key(strategy: Dict[str, Any]) -> str:
+    """提取策略的稳定标识：方法名、类型和第一个选择器/模式，同名方法的不同策略也能区分"""
+    first = (strategy.get("selectors") or strategy.get("patterns") or [strategy.get("xpath", "")])[0]
+    return f"{strategy['method']}:{strategy['type']}:{first}"
+
+
+def adaptive_spec(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """按 selector_registry 的历史表现重排每个字段的策略，并附上策略标识供页面内回报"""
+    fields = {}
+    for field, conf in spec["fields"].items():
+        strategies = [{**strategy, "key": strategy_key(strategy)} for strategy in conf["strategies"]]
+        fields[field] = {**conf, "strategies": selector_registry.ordered(f"note:{field}", strategies,
+                                                                         key=lambda item: item["key"])}
+    return {**spec, "fields": fields}
+
+
+async def extract_note_fields(page, spec: Optional[Dict[str, Any]] = None):
+    """按提取规则在页面内一次性提取笔记字段，策略顺序由 selector_registry 自适应调整
+
+    Returns:
+        (字段字典, 每个字段命中的方法名；未命中为None)
     """
-    for attempt in range(2):
-        try:
-            login_status = await ensure_browser()
-            if not login_status:
-                return "请先登录小红书账号"
-            page = await browser_context.new_page()
-            logging.info(f"[{datetime.now()}] 新建标签页: {page}, tool: search_notes, keywords: {keywords}")
-            try:
-                search_url = f"https://www.xiaohongshu.com/search_result?keyword={keywords}"
-                logging.info(f"[{datetime.now()}] search_notes: page.goto({search_url}) 开始")
-                await page.goto(search_url, timeout=60000)
-                logging.info(f"[{datetime.now()}] search_notes: page.goto({search_url}) 完成")
-                await asyncio.sleep(5)
-                await asyncio.sleep(5)
-                page_html = await page.content()
-                logging.info(f"页面HTML片段: {page_html[10000:10500]}...")
-                logging.info("尝试获取帖子卡片...")
-                post_cards = await page.query_selector_all('section.note-item')
-                logging.info(f"找到 {len(post_cards)} 个帖子卡片")
-                if not post_cards:
-                    post_cards = await page.query_selector_all('div[data-v-a264b01a]')
-                    logging.info(f"使用备用选择器找到 {len(post_cards)} 个帖子卡片")
-                post_links = []
-                post_titles = []
-                for card in post_cards:
-                    try:
-                        link_element = await card.query_selector('a[href*="/search_result/"]')
-                        if not link_element:
-                            continue
-                        href = await link_element.get_attribute('href')
-                        if href and '/search_result/' in href:
-                            full_url = f"https://www.xiaohongshu.com{href}"
-                            post_links.append(full_url)
-                            try:
-                                card_html = await card.inner_html()
-                                logging.info(f"卡片HTML片段: {card_html[:200]}...")
-                                title_element = await card.query_selector('div.footer a.title span')
-                                if title_element:
-                                    title = await title_element.text_content()
-                                    logging.info(f"找到标题(方法1): {title}")
-                                else:
-                                    title_element = await card.query_selector('a.title span')
-                                    if title_element:
-                                        title = await title_element.text_content()
-                                        logging.info(f"找到标题(方法2): {title}")
-                                    else:
-                                        text_elements = await card.query_selector_all('span')
-                                        potential_titles = []
-                                        for text_el in text_elements:
-                                            text = await text_el.text_content()
-                                            if text and len(text.strip()) > 5:
-                                                potential_titles.append(text.strip())
-                                        if potential_titles:
-                                            title = max(potential_titles, key=len)
-                                            logging.info(f"找到可能的标题(方法3): {title}")
-                                        else:
-                                            all_text = await card.evaluate('el => Array.from(el.querySelectorAll("*")).map(node => node.textContent).filter(text => text && text.trim().length > 5)')
-                                            if all_text and len(all_text) > 0:
-                                                title = max(all_text, key=len)
-                                                logging.info(f"找到可能的标题(方法4): {title}")
-                                            else:
-                                                title = "未知标题"
-                                                logging.info("无法找到标题，使用默认值'未知标题'")
-                                if not title or title.strip() == "":
-                                    title = "未知标题"
-                                    logging.info("获取到的标题为空，使用默认值'未知标题'")
-                            except Exception as e:
-                                logging.exception(f"获取标题时出错: {str(e)}")
-                                title = "未知标题"
-                            post_titles.append(title)
-                    except Exception as e:
-                        logging.exception(f"处理帖子卡片时出错: {str(e)}")
-                unique_posts = []
-                seen_urls = set()
-                for url, title in zip(post_links, post_titles):
-                    if url not in seen_urls:
-                        seen_urls.add(url)
-                        unique_posts.append({"url": url, "title": title})
-                unique_posts = unique_posts[:limit]
-                if unique_posts:
-                    result = "搜索结果：\n\n"
-                    for i, post in enumerate(unique_posts, 1):
-                        result += f"{i}. {post['title']}\n   链接: {post['url']}\n\n"
-                    return result
-                else:
-                    return f"未找到与\"{keywords}\"相关的笔记"
-            finally:
-                logging.info(f"[{datetime.now()}] search_notes: 关闭标签页: {page}")
-                await page.close()
-        except Exception as e:
-            if attempt == 0 and ("context" in str(e).lower() or "browser has been closed" in str(e).lower() or "Target page" in str(e)):
-                continue
-            return f"搜索笔记时出错: {str(e)}"
+    with metrics.timer("extract_fields"):
+        result = await page.evaluate(NOTE_EXTRACT_JS, adaptive_spec(spec or NOTE_EXTRACTION_SPEC))
+    for field, method in result["matched"].items():
+        metrics.incr("field_method", f"{field}:{method or 'none'}")
+    for field, attempts in result["attempts"].items():
+        for key, success, elapsed_ms in attempts:
+            selector_registry.record(f"note:{field}", key, success, elapsed_ms / 1000)
+    return result["fields"], result["matched"]
+
 
 @mcp.tool()
-async def get_note_content(url: str) -> str:
+@instrumented
+async def get_note_content(url: str, use_cache: bool = True, output_format: str = "text") -> Union[str, dict]:
     """获取笔记内容
     
     Args:
         url: 笔记 URL
+        use_cache: 是否使用缓存结果，传False强制重新加载
+        output_format: 输出格式，"text" 为文本，"json" 为结构化结果 {url, title, author, published_at, content}
     """
+    return note_output(await load_note(url, use_cache), output_format)
+
+
+def note_output(note: Union[Note, str], output_format: str = "text") -> Union[str, dict]:
+    """把 load_note 的返回值转为 get_note_content 的输出格式"""
+    if isinstance(note, Note):
+        return note.to_dict() if output_format == "json" else format_note_content(note)
+    return {"error": note} if output_format == "json" else note
+
+
+async def load_note(url: str, use_cache: bool = True) -> Union[Note, str]:
+    """返回笔记记录，依次查缓存、本地笔记库和页面；出错时返回错误信息"""
+    cache_key = normalize_note_url(url)
+    if use_cache:
+        cached = result_cache.get("get_note_content", cache_key)
+        if cached is not None:
+            return cached
+        stored = note_store.get_note(url, max_age=STORE_MAX_AGES["note"])
+        if stored:
+            metrics.incr("cache", "store")
+            result_cache.put("get_note_content", cache_key, stored)
+            return stored
+    result = await single_flight.do(("get_note_content", cache_key), lambda: _fetch_note_content(url, cache_key))
+    return result if result is not None else "获取笔记内容时出错: 页面解析失败"
+
+
+async def _fetch_note_content(url: str, cache_key: str) -> Union[Note, str]:
+    """打开笔记页并提取内容，同一笔记的并发调用由single_flight合并为一次"""
     for attempt in range(2):
         try:
-            login_status = await ensure_browser()
-            if not login_status:
+            page = await account_scheduler.acquire_page("get_note_content")
+            if page is None:
                 return "请先登录小红书账号"
-            page = await browser_context.new_page()
-            logging.info(f"[{datetime.now()}] 新建标签页: {page}, tool: get_note_content, url: {url}")
+            note_logger.debug("借出标签页: %s, tool: get_note_content, url: %s", page, url)
+            capture = start_capture(page, ["note"])
             try:
-                await page.goto(url, timeout=60000)
-                await asyncio.sleep(10)
-                await page.evaluate('''
-                    () => {
-                        window.scrollTo(0, document.body.scrollHeight);
-                        setTimeout(() => { window.scrollTo(0, document.body.scrollHeight / 2); }, 1000);
-                        setTimeout(() => { window.scrollTo(0, 0); }, 2000);
-                    }
-                ''')
-                await asyncio.sleep(3)
-                try:
-                    logging.info("打印页面结构片段用于分析")
-                    page_structure = await page.evaluate('''
-                        () => {
-                            const noteContent = document.querySelector('.note-content');
-                            const detailDesc = document.querySelector('#detail-desc');
-                            const commentArea = document.querySelector('.comments-container, .comment-list');
-                            return {
-                                hasNoteContent: !!noteContent,
-                                hasDetailDesc: !!detailDesc,
-                                hasCommentArea: !!commentArea,
-                                noteContentHtml: noteContent ? noteContent.outerHTML.slice(0, 500) : null,
-                                detailDescHtml: detailDesc ? detailDesc.outerHTML.slice(0, 500) : null,
-                                commentAreaFirstChild: commentArea ? 
-                                    (commentArea.firstElementChild ? commentArea.firstElementChild.outerHTML.slice(0, 500) : null) : null
-                            };
-                        }
-                    ''')
-                    logging.info(f"页面结构分析: {json.dumps(page_structure, ensure_ascii=False, indent=2)}")
-                except Exception as e:
-                    logging.exception(f"打印页面结构时出错: {str(e)}")
-                post_content = {}
-                try:
-                    logging.info("尝试获取标题 - 方法1：使用id选择器")
-                    title_element = await page.query_selector('#detail-title')
-                    if title_element:
-                        title = await title_element.text_content()
-                        post_content["标题"] = title.strip() if title else "未知标题"
-                        logging.info(f"方法1获取到标题: {post_content['标题']}")
-                    else:
-                        logging.info("方法1未找到标题元素")
-                        post_content["标题"] = "未知标题"
-                except Exception as e:
-                    logging.exception(f"方法1获取标题出错: {str(e)}")
-                    post_content["标题"] = "未知标题"
-                if post_content["标题"] == "未知标题":
-                    try:
-                        logging.info("尝试获取标题 - 方法2：使用class选择器")
-                        title_element = await page.query_selector('div.title')
-                        if title_element:
-                            title = await title_element.text_content()
-                            post_content["标题"] = title.strip() if title else "未知标题"
-                            logging.info(f"方法2获取到标题: {post_content['标题']}")
-                        else:
-                            logging.info("方法2未找到标题元素")
-                    except Exception as e:
-                        logging.exception(f"方法2获取标题出错: {str(e)}")
-                if post_content["标题"] == "未知标题":
-                    try:
-                        logging.info("尝试获取标题 - 方法3：使用JavaScript")
-                        title = await page.evaluate('''
-                            () => {
-                                const selectors = [
-                                    '#detail-title',
-                                    'div.title',
-                                    'h1',
-                                    'div.note-content div.title'
-                                ];
-                                for (const selector of selectors) {
-                                    const el = document.querySelector(selector);
-                                    if (el && el.textContent.trim()) {
-                                        return el.textContent.trim();
-                                    }
-                                }
-                                return null;
-                            }
-                        ''')
-                        if title:
-                            post_content["标题"] = title
-                            logging.info(f"方法3获取到标题: {post_content['标题']}")
-                        else:
-                            logging.info("方法3未找到标题元素")
-                    except Exception as e:
-                        logging.exception(f"方法3获取标题出错: {str(e)}")
-                try:
-                    logging.info("尝试获取作者 - 方法1：使用username类选择器")
-                    author_element = await page.query_selector('span.username')
-                    if author_element:
-                        author = await author_element.text_content()
-                        post_content["作者"] = author.strip() if author else "未知作者"
-                        logging.info(f"方法1获取到作者: {post_content['作者']}")
-                    else:
-                        logging.info("方法1未找到作者元素")
-                        post_content["作者"] = "未知作者"
-                except Exception as e:
-                    logging.exception(f"方法1获取作者出错: {str(e)}")
-                    post_content["作者"] = "未知作者"
-                if post_content["作者"] == "未知作者":
-                    try:
-                        logging.info("尝试获取作者 - 方法2：使用链接选择器")
-                        author_element = await page.query_selector('a.name')
-                        if author_element:
-                            author = await author_element.text_content()
-                            post_content["作者"] = author.strip() if author else "未知作者"
-                            logging.info(f"方法2获取到作者: {post_content['作者']}")
-                        else:
-                            logging.info("方法2未找到作者元素")
-                    except Exception as e:
-                        logging.exception(f"方法2获取作者出错: {str(e)}")
-                if post_content["作者"] == "未知作者":
-                    try:
-                        logging.info("尝试获取作者 - 方法3：使用JavaScript")
-                        author = await page.evaluate('''
-                            () => {
-                                const selectors = [
-                                    'span.username',
-                                    'a.name',
-                                    '.author-wrapper .username',
-                                    '.info .name'
-                                ];
-                                for (const selector of selectors) {
-                                    const el = document.querySelector(selector);
-                                    if (el && el.textContent.trim()) {
-                                        return el.textContent.trim();
-                                    }
-                                }
-                                return null;
-                            }
-                        ''')
-                        if author:
-                            post_content["作者"] = author
-                            logging.info(f"方法3获取到作者: {post_content['作者']}")
-                        else:
-                            logging.info("方法3未找到作者元素")
-                    except Exception as e:
-                        logging.exception(f"方法3获取作者出错: {str(e)}")
-                try:
-                    logging.info("尝试获取发布时间 - 方法1：使用date类选择器")
-                    time_element = await page.query_selector('span.date')
-                    if time_element:
-                        time_text = await time_element.text_content()
-                        post_content["发布时间"] = time_text.strip() if time_text else "未知"
-                        logging.info(f"方法1获取到发布时间: {post_content['发布时间']}")
-                    else:
-                        logging.info("方法1未找到发布时间元素")
-                        post_content["发布时间"] = "未知"
-                except Exception as e:
-                    logging.exception(f"方法1获取发布时间出错: {str(e)}")
-                    post_content["发布时间"] = "未知"
-                if post_content["发布时间"] == "未知":
-                    try:
-                        logging.info("尝试获取发布时间 - 方法2：使用正则表达式匹配")
-                        time_selectors = [
-                            'text=/编辑于/',
-                            'text=/\\d{2}-\\d{2}/',
-                            'text=/\\d{4}-\\d{2}-\\d{2}/',
-                            'text=/\\d+月\\d+日/',
-                            'text=/\\d+天前/',
-                            'text=/\\d+小时前/',
-                            'text=/今天/',
-                            'text=/昨天/'
-                        ]
-                        for selector in time_selectors:
-                            time_element = await page.query_selector(selector)
-                            if time_element:
-                                time_text = await time_element.text_content()
-                                post_content["发布时间"] = time_text.strip() if time_text else "未知"
-                                logging.info(f"方法2获取到发布时间: {post_content['发布时间']}")
-                                break
-                            else:
-                                logging.info(f"方法2未找到发布时间元素: {selector}")
-                    except Exception as e:
-                        logging.exception(f"方法2获取发布时间出错: {str(e)}")
-                if post_content["发布时间"] == "未知":
-                    try:
-                        logging.info("尝试获取发布时间 - 方法3：使用JavaScript")
-                        time_text = await page.evaluate('''
-                            () => {
-                                const selectors = [
-                                    'span.date',
-                                    '.bottom-container .date',
-                                    '.date'
-                                ];
-                                for (const selector of selectors) {
-                                    const el = document.querySelector(selector);
-                                    if (el && el.textContent.trim()) {
-                                        return el.textContent.trim();
-                                    }
-                                }
-                                const dateRegexes = [
-                                    /编辑于\s*([\d-]+)/,
-                                    /(\d{2}-\d{2})/,
-                                    /(\d{4}-\d{2}-\d{2})/,
-                                    /(\d+月\d+日)/,
-                                    /(\d+天前)/,
-                                    /(\d+小时前)/,
-                                    /(今天)/,
-                                    /(昨天)/
-                                ];
-                                const allText = document.body.textContent;
-                                for (const regex of dateRegexes) {
-                                    const match = allText.match(regex);
-                                    if (match) {
-                                        return match[0];
-                                    }
-                                }
-                                return null;
-                            }
-                        ''')
-                        if time_text:
-                            post_content["发布时间"] = time_text
-                            logging.info(f"方法3获取到发布时间: {post_content['发布时间']}")
-                        else:
-                            logging.info("方法3未找到发布时间元素")
-                    except Exception as e:
-                        logging.exception(f"方法3获取发布时间出错: {str(e)}")
-                try:
-                    logging.info("尝试获取正文内容 - 方法1：使用精确的ID和class选择器")
-                    await page.evaluate('''
-                        () => {
-                            const commentSelectors = [
-                                '.comments-container', 
-                                '.comment-list',
-                                '.feed-comment',
-                                'div[data-v-aed4aacc]',  
-                                '.content span.note-text'  
-                            ];
-                            for (const selector of commentSelectors) {
-                                const elements = document.querySelectorAll(selector);
-                                elements.forEach(el => {
-                                    if (el) {
-                                        el.setAttribute('data-is-comment', 'true');
-                                        console.log('标记评论区域:', el.tagName, el.className);
-                                    }
-                                });
-                            }
-                        }
-                    ''')
-                    content_element = await page.query_selector('#detail-desc .note-text')
-                    if content_element:
-                        is_in_comment = await content_element.evaluate('(el) => !!el.closest("[data-is-comment=\'true\']") || false')
-                        if not is_in_comment:
-                            content_text = await content_element.text_content()
-                            if content_text and len(content_text.strip()) > 50:
-                                post_content["内容"] = content_text.strip()
-                                logging.info(f"方法1获取到正文内容，长度: {len(post_content['内容'])}")
-                            else:
-                                logging.info(f"方法1获取到的内容太短: {len(content_text.strip() if content_text else 0)}")
-                                post_content["内容"] = "未能获取内容"
-                        else:
-                            logging.info("方法1找到的元素在评论区域内，跳过")
-                            post_content["内容"] = "未能获取内容"
-                    else:
-                        logging.info("方法1未找到正文内容元素")
-                        post_content["内容"] = "未能获取内容"
-                except Exception as e:
-                    logging.exception(f"方法1获取正文内容出错: {str(e)}")
-                    post_content["内容"] = "未能获取内容"
-                if post_content["内容"] == "未能获取内容":
-                    try:
-                        logging.info("尝试获取正文内容 - 方法2：使用XPath选择器")
-                        content_text = await page.evaluate('''
-                            () => {
-                                const xpath = '//div[@id="detail-desc"]/span[@class="note-text"]';
-                                const result = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null);
-                                const element = result.singleNodeValue;
-                                return element ? element.textContent.trim() : null;
-                            }
-                        ''')
-                        if content_text and len(content_text) > 20:
-                            post_content["内容"] = content_text
-                            logging.info(f"方法2获取到正文内容，长度: {len(post_content['内容'])}")
-                        else:
-                            logging.info(f"方法2获取到的内容太短或为空: {len(content_text) if content_text else 0}")
-                    except Exception as e:
-                        logging.exception(f"方法2获取正文内容出错: {str(e)}")
-                if post_content["内容"] == "未能获取内容":
-                    try:
-                        logging.info("尝试获取正文内容 - 方法3：使用JavaScript获取最长文本")
-                        content_text = await page.evaluate('''
-                            () => {
-                                const commentSelectors = [
-                                    '.comments-container', 
-                                    '.comment-list',
-                                    '.feed-comment',
-                                    'div[data-v-aed4aacc]',
-                                    '.comment-item',
-                                    '[data-is-comment="true"]'
-                                ];
-                                let commentAreas = [];
-                                for (const selector of commentSelectors) {
-                                    const elements = document.querySelectorAll(selector);
-                                    elements.forEach(el => commentAreas.push(el));
-                                }
-                                const contentElements = Array.from(document.querySelectorAll('div#detail-desc, div.note-content, div.desc, span.note-text'))
-                                    .filter(el => {
-                                        const isInComment = commentAreas.some(commentArea => 
-                                            commentArea && commentArea.contains(el));
-                                        if (isInComment) {
-                                            console.log('排除评论区域内容:', el.tagName, el.className);
-                                            return false;
-                                        }
-                                        const text = el.textContent.trim();
-                                        return text.length > 100 && text.length < 10000;
-                                    })
-                                    .sort((a, b) => b.textContent.length - a.textContent.length);
-                                if (contentElements.length > 0) {
-                                    console.log('找到内容元素:', contentElements[0].tagName, contentElements[0].className);
-                                    return contentElements[0].textContent.trim();
-                                }
-                                return null;
-                            }
-                        ''')
-                        if content_text and len(content_text) > 100:
-                            post_content["内容"] = content_text
-                            logging.info(f"方法3获取到正文内容，长度: {len(post_content['内容'])}")
-                        else:
-                            logging.info(f"方法3获取到的内容太短或为空: {len(content_text) if content_text else 0}")
-                    except Exception as e:
-                        logging.exception(f"方法3获取正文内容出错: {str(e)}")
-                if post_content["内容"] == "未能获取内容":
-                    try:
-                        logging.info("尝试获取正文内容 - 方法4：区分正文和评论内容")
-                        content_text = await page.evaluate('''
-                            () => {
-                                const noteContent = document.querySelector('.note-content');
-                                if (noteContent) {
-                                    const noteText = noteContent.querySelector('.note-text');
-                                    if (noteText && noteText.textContent.trim().length > 50) {
-                                        return noteText.textContent.trim();
-                                    }
-                                    if (noteContent.textContent.trim().length > 50) {
-                                        return noteContent.textContent.trim();
-                                    }
-                                }
-                                const paragraphs = Array.from(document.querySelectorAll('p'))
-                                    .filter(p => {
-                                        const isInComments = p.closest('.comments-container, .comment-list');
-                                        return !isInComments && p.textContent.trim().length > 10;
-                                    });
-                                if (paragraphs.length > 0) {
-                                    return paragraphs.map(p => p.textContent.trim()).join('\n\n');
-                                }
-                                return null;
-                            }
-                        ''')
-                        if content_text and len(content_text) > 50:
-                            post_content["内容"] = content_text
-                            logging.info(f"方法4获取到正文内容，长度: {len(post_content['内容'])}")
-                        else:
-                            logging.info(f"方法4获取到的内容太短或为空: {len(content_text) if content_text else 0}")
-                    except Exception as e:
-                        logging.exception(f"方法4获取正文内容出错: {str(e)}")
-                if post_content["内容"] == "未能获取内容":
-                    try:
-                        logging.info("尝试获取正文内容 - 方法5：直接通过DOM结构定位")
-                        content_text = await page.evaluate('''
-                            () => {
-                                const noteContent = document.querySelector('div.note-content');
-                                if (noteContent) {
-                                    const detailTitle = noteContent.querySelector('#detail-title');
-                                    const detailDesc = noteContent.querySelector('#detail-desc');
-                                    if (detailDesc) {
-                                        const noteText = detailDesc.querySelector('span.note-text');
-                                        if (noteText) {
-                                            return noteText.textContent.trim();
-                                        }
-                                        return detailDesc.textContent.trim();
-                                    }
-                                }
-                                const descElements = document.querySelectorAll('div.desc');
-                                for (const desc of descElements) {
-                                    const isInComment = desc.closest('.comments-container, .comment-list, .feed-comment');
-                                    if (!isInComment && desc.textContent.trim().length > 100) {
-                                        return desc.textContent.trim();
-                                    }
-                                }
-                                return null;
-                            }
-                        ''')
-                        if content_text and len(content_text) > 100:
-                            post_content["内容"] = content_text
-                            logging.info(f"方法5获取到正文内容，长度: {len(post_content['内容'])}")
-                        else:
-                            logging.info(f"方法5获取到的内容太短或为空: {len(content_text) if content_text else 0}")
-                    except Exception as e:
-                        logging.exception(f"方法5获取正文内容出错: {str(e)}")
-                result = f"标题: {post_content['标题']}\n"
-                result += f"作者: {post_content['作者']}\n"
-                result += f"发布时间: {post_content['发布时间']}\n"
-                result += f"链接: {url}\n\n"
-                result += f"内容:\n{post_content['内容']}"
-                return result
+                await paced_goto(page, url, "get_note_content")
+                post_content = None
+                captured = await wait_capture_or_ready(page, capture, "note", NOTE_READY_SELECTORS,
+                                                       READY_TIMEOUTS["get_note_content"], fallback_sleep=10)
+                if captured:
+                    post_content = parse_note_payload(capture.payloads["note"][0])
+                if post_content:
+                    note_logger.info("从笔记详情接口解析到笔记内容")
+                    metrics.incr("source", "capture")
+                else:
+                    post_content = await _extract_note_from_dom(page, wait_ready=captured)
+                    metrics.incr("source", "dom")
+                note = Note.from_fields(url, post_content)
+                # 只有占位值的笔记不写入缓存和本地笔记库，避免覆盖已有内容或污染关键词语料
+                if note.extracted:
+                    note_store.upsert_note(note)
+                    result_cache.put("get_note_content", cache_key, note)
+                else:
+                    note_logger.warning("未能从笔记页提取标题和内容，不缓存结果: %s", url)
+                return note
             except Exception as e:
-                logging.exception(f"获取笔记内容时出错: {str(e)}")
+                note_logger.exception("获取笔记内容时出错: %s", e)
+            finally:
+                if capture:
+                    capture.detach()
+                await account_scheduler.release_page(page)
         except Exception as e:
             if attempt == 0 and ("context" in str(e).lower() or "browser has been closed" in str(e).lower() or "Target page" in str(e)):
                 # 第一次失败且是context相关异常，重试
+                metrics.incr("retry")
                 continue
             return f"获取笔记内容时出错: {str(e)}"
 
+
+async def _extract_note_from_dom(page, wait_ready: bool = True) -> Dict[str, str]:
+    """等待笔记详情渲染后从DOM中提取字段（网络捕获失败时的兜底路径）
+
+    Args:
+        page: 标签页
+        wait_ready: 是否先等待页面就绪，调用方已等待过时传False
+    """
+    if wait_ready:
+        await wait_for_ready(page, NOTE_READY_SELECTORS, READY_TIMEOUTS["get_note_content"], fallback_sleep=10)
+    # 滚动一遍触发懒加载，随后等待DOM稳定而不是固定等待
+    await page.evaluate('''
+        async () => {
+            const pause = () => new Promise(r => setTimeout(r, 200));
+            window.scrollTo(0, document.body.scrollHeight);
+            await pause();
+            window.scrollTo(0, document.body.scrollHeight / 2);
+            await pause();
+            window.scrollTo(0, 0);
+        }
+    ''')
+    await wait_for_dom_stable(page, quiet_ms=300, max_ms=3000)
+    await debug_dump_html(page, note_logger, "笔记详情页")
+    post_content, matched = await extract_note_fields(page)
+    note_logger.info("笔记字段提取命中方法: %s", matched)
+    return post_content
+
+COMMENT_ITEM_SELECTORS = [
+    "div.comment-item",
+    "div.commentItem",
+    "div.comment-content",
+    "div.comment-wrapper",
+    "section.comment",
+    "div.feed-comment"
+]
+
+# 评论页面脚本共用的辅助函数：字段文本提取和评论ID计算。
+# 加载轮次（收集已加载的评论ID）和最终提取必须得到相同的ID，增量同步才能识别已见过的评论。
+# 评论元素自带ID时直接使用，否则用用户名+内容的哈希作为稳定ID（时间是“3天前”这类相对时间，不参与哈希）。
+COMMENT_JS_HELPERS = '''
+        const textOf = el => (el && el.textContent ? el.textContent.trim() : '');
+        const firstText = (root, selectors) => {
+            for (const selector of selectors) {
+                const text = textOf(root.querySelector(selector));
+                if (text) return text;
+            }
+            return '';
+        };
+        const hashOf = str => {
+            let hash = 5381;
+            for (let i = 0; i < str.length; i++) {
+                hash = ((hash << 5) + hash + str.charCodeAt(i)) | 0;
+            }
+            return 'h' + (hash >>> 0).toString(16);
+        };
+        const commentText = (item, usernameSelectors, contentSelectors) => {
+            const username = firstText(item, usernameSelectors)
+                || textOf(item.querySelector('a[href*="/user/profile/"]'));
+            let content = firstText(item, contentSelectors);
+            if (!content) {
+                const fullText = textOf(item);
+                content = username && fullText.includes(username) ? fullText.replace(username, '').trim() : fullText;
+            }
+            return {username, content};
+        };
+        const commentIdOf = (item, username, content) => {
+            const ownId = item.id || item.getAttribute('data-id') || item.getAttribute('data-comment-id');
+            return ownId ? ownId.replace(/^comment-/, '') : hashOf(username + '|' + content);
+        };
+'''
+
+# 单轮评论加载：统计当前评论数，点击可见的“加载更多”/“展开回复”，再把最后一条评论滚动到可视区域。
+# 全部在页面内完成，每轮只需一次IPC调用。
+COMMENT_LOAD_ROUND_JS = '''
+    ([itemSelectors, moreTexts, expandReplies, collectIds, usernameSelectors, contentSelectors]) => {
+''' + COMMENT_JS_HELPERS + '''
+        let items = [];
+        for (const selector of itemSelectors) {
+            items = document.querySelectorAll(selector);
+            if (items.length) break;
+        }
+        const count = items.length;
+        const ids = collectIds ? Array.from(items).map(el => {
+            const {username, content} = commentText(el, usernameSelectors, contentSelectors);
+            return commentIdOf(el, username, content);
+        }) : [];
+        const visible = el => {
+            const rect = el.getBoundingClientRect();
+            return rect.width > 0 && rect.height > 0;
+        };
+        const replyPattern = /^展开\\s*(\\d+\\s*条回复|更多回复)/;
+        let clicked = 0;
+        let repliesExpanded = 0;
+        const walker = document.createTreeWalker(document.body, NodeFilter.SHOW_TEXT);
+        const targets = [];
+        let node;
+        while ((node = walker.nextNode())) {
+            const text = node.data.trim();
+            if (!text || !node.parentElement) continue;
+            if (moreTexts.some(t => text.includes(t))) {
+                targets.push([node.parentElement, false]);
+            } else if (expandReplies && replyPattern.test(text)) {
+                targets.push([node.parentElement, true]);
+            }
+        }
+        for (const [el, isReply] of targets) {
+            if (!visible(el)) continue;
+            el.click();
+            if (isReply) repliesExpanded++; else clicked++;
+        }
+        if (count) {
+            items[count - 1].scrollIntoView({block: 'end'});
+        }
+        window.scrollBy(0, 500);
+        return {count, clicked, repliesExpanded, ids};
+    }
+'''
+
+# 评论的页面内一次性提取：返回每条评论的ID、父评论ID、用户名、内容、时间和点赞数。
+COMMENT_EXTRACT_JS = '''
+    ([itemSelectors, usernameSelectors, contentSelectors, timeSelectors, likeSelectors]) => {
+''' + COMMENT_JS_HELPERS + '''
+        let items = [];
+        let itemSelector = '';
+        const attempts = [];
+        for (const selector of itemSelectors) {
+            const started = performance.now();
+            items = Array.from(document.querySelectorAll(selector));
+            attempts.push([selector, items.length > 0, performance.now() - started]);
+            if (items.length) {
+                itemSelector = selector;
+                break;
+            }
+        }
+        const ids = new Map();
+        const records = [];
+        for (const item of items) {
+            const {username, content} = commentText(item, usernameSelectors, contentSelectors);
+            const time = firstText(item, timeSelectors) || '未知时间';
+            const likes = firstText(item, likeSelectors);
+            const id = commentIdOf(item, username, content);
+            ids.set(item, id);
+            const parent = item.parentElement ? item.parentElement.closest(itemSelector) : null;
+            if (!username || content.length <= 2) continue;
+            records.push({id, parent: parent || null, username, content, time, likes: /^\\d+$/.test(likes) ? likes : '0'});
+        }
+        if (!records.length) {
+            // 兜底：从用户主页链接出发，取其后的兄弟元素文本作为评论内容
+            for (const link of document.querySelectorAll('a[href*="/user/profile/"]')) {
+                const username = textOf(link);
+                let content = '';
+                let sibling = link.nextElementSibling;
+                while (sibling && !content) {
+                    content = textOf(sibling);
+                    sibling = sibling.nextElementSibling;
+                }
+                if (!content && link.parentElement) {
+                    content = textOf(link.parentElement).replace(username, '').trim();
+                }
+                if (username && content) {
+                    records.push({id: hashOf(username + '|' + content), parent: null, username, content,
+                                  time: '未知时间', likes: '0'});
+                }
+            }
+        }
+        return {
+            records: records.map(r => ({...r, parent: r.parent ? (ids.get(r.parent) || null) : null})),
+            attempts: itemSelector ? attempts : [],
+        };
+    }
+'''
+
+COMMENT_FIELD_SELECTORS = {
+    "username": ["span.user-name", "a.name", "div.username", "span.nickname", "a.user-nickname"],
+    "content": ["div.content", "p.content", "div.text", "span.content", "div.comment-text"],
+    "time": ["span.time", "div.time", "span.date", "div.date", "time"],
+    "likes": [".like .count", "span.like-count", ".like-wrapper .count"],
+}
+
+
+def comment_item_selectors() -> List[str]:
+    """按 selector_registry 的历史表现排列的评论元素选择器"""
+    return selector_registry.ordered("comment_item", COMMENT_ITEM_SELECTORS)
+
+
+async def extract_comments(page, record_stats: bool = True) -> List[Comment]:
+    """在页面内一次性提取全部评论（含楼中楼回复），耗时与评论数成线性且只需一次IPC调用
+
+    页面中没有任何评论元素时不记录选择器统计，无法区分没有评论和选择器失效。
+
+    Args:
+        page: 标签页
+        record_stats: 是否把选择器的命中情况记入 selector_registry，加载过程中的中间提取传False
+    """
+    result = await page.evaluate(COMMENT_EXTRACT_JS, [
+        comment_item_selectors(),
+        COMMENT_FIELD_SELECTORS["username"],
+        COMMENT_FIELD_SELECTORS["content"],
+        COMMENT_FIELD_SELECTORS["time"],
+        COMMENT_FIELD_SELECTORS["likes"],
+    ])
+    if record_stats:
+        for selector, success, elapsed_ms in result["attempts"]:
+            selector_registry.record("comment_item", selector, success, elapsed_ms / 1000)
+    return [Comment(record["id"], record["parent"], record["username"], record["content"], record["time"], record["likes"])
+            for record in result["records"]]
+
+
+COMMENT_MORE_TEXTS = ["查看更多评论", "展开更多评论", "加载更多", "查看全部"]
+
+
+async def load_comments(page, capture: Optional[ResponseCapture], target_count: int = COMMENT_TARGET_COUNT,
+                        time_budget: float = COMMENT_LOAD_BUDGET, expand_replies: bool = False,
+                        stop_ids: Optional[set] = None) -> Dict[str, Any]:
+    """自适应加载评论：评论数达到目标、连续多轮不再增长、接口显示没有更多或超出时间预算时停止
+
+    评论数优先以接口捕获到的评论为准，未捕获到接口数据时以页面中的评论元素数为准。
+    客户端请求进度时，每批接口数据都会作为进度通知发送；尚未捕获到接口数据时（未开启捕获或接口未响应），
+    每轮从页面提取评论并发送新出现的评论。
+    传入stop_ids（已见过的评论ID）时，一旦加载到其中任意一条即停止（增量同步）。
+    expand_replies为True时至少执行一轮页面加载，接口显示没有更多评论后仍继续，直到不再有可展开的回复。
+
+    Returns:
+        dict: rounds（加载轮数）、count（最后一次统计的评论数）、stop_reason（停止原因）
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + time_budget
+    rounds = 0
+    last_count = -1
+    idle_rounds = 0
+    stop_reason = "time_budget"
+    count = 0
+    api_count = 0
+    checked_payloads = 0
+    reported_ids = set()  # 页面模式下已通过进度通知发送过的评论ID
+    replies_pending = expand_replies  # 是否可能还有未展开的回复：尚未执行加载轮次或上一轮点击了“展开回复”
+    item_selectors = comment_item_selectors()
+    while loop.time() < deadline:
+        if capture:
+            new_payloads = capture.payloads["comments"][checked_payloads:]
+            checked_payloads += len(new_payloads)
+            new_ids = [raw.get("id") for payload in new_payloads
+                       for raw in (payload.get("data") or {}).get("comments") or []]
+            api_count += len(new_ids)
+            if new_payloads:
+                await report_progress(api_count, target_count, f"第{rounds}轮已加载 {api_count} 条评论，本批: " + json.dumps(
+                    [comment.to_dict() for comment in parse_comment_payloads(new_payloads)], ensure_ascii=False))
+            if stop_ids and any(comment_id in stop_ids for comment_id in new_ids):
+                stop_reason = "reached_cursor"
+                break
+        no_more = bool(capture and capture.payloads["comments"] and not capture.has_more("comments"))
+        if no_more and not replies_pending:
+            count = max(count, api_count)
+            stop_reason = "no_more"
+            break
+        payload_count = len(capture.payloads["comments"]) if capture else 0
+        state = await page.evaluate(COMMENT_LOAD_ROUND_JS,
+                                    [item_selectors, COMMENT_MORE_TEXTS, expand_replies, bool(stop_ids),
+                                     COMMENT_FIELD_SELECTORS["username"], COMMENT_FIELD_SELECTORS["content"]])
+        rounds += 1
+        replies_pending = expand_replies and state["repliesExpanded"] > 0
+        count = max(state["count"], api_count)
+        if not api_count and current_progress.get() is not None:
+            new_comments = [comment for comment in await extract_comments(page, record_stats=False)
+                            if comment.comment_id not in reported_ids]
+            reported_ids.update(comment.comment_id for comment in new_comments)
+            await report_progress(count, target_count, f"第{rounds}轮页面中共有 {count} 条评论，本批: " + json.dumps(
+                [comment.to_dict() for comment in new_comments], ensure_ascii=False))
+        if stop_ids and any(comment_id in stop_ids for comment_id in state["ids"]):
+            stop_reason = "reached_cursor"
+            break
+        if count >= target_count:
+            stop_reason = "target_reached"
+            break
+        if count <= last_count and not state["clicked"] and not state["repliesExpanded"]:
+            idle_rounds += 1
+            if idle_rounds >= COMMENT_IDLE_ROUNDS:
+                stop_reason = "no_growth"
+                break
+        else:
+            idle_rounds = 0
+        last_count = max(last_count, count)
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        if capture and not no_more:
+            await capture.wait_for_new("comments", payload_count, timeout=min(remaining, 2))
+        await wait_for_dom_stable(page, quiet_ms=300, max_ms=int(min(remaining, 2) * 1000))
+    comment_logger.info("评论加载结束: %s 轮, %s 条, 停止原因: %s", rounds, count, stop_reason)
+    return {"rounds": rounds, "count": count, "stop_reason": stop_reason}
+
+
 @mcp.tool()
-async def get_note_comments(url: str) -> str:
+@instrumented
+async def get_note_comments(url: str, use_cache: bool = True, target_count: int = COMMENT_TARGET_COUNT,
+                            time_budget: float = COMMENT_LOAD_BUDGET, expand_replies: bool = False,
+                            incremental: bool = False, output_format: str = "text", ctx: Context = None) -> Union[str, dict]:
     """获取笔记评论
     
     Args:
         url: 笔记 URL
+        use_cache: 是否使用缓存结果，传False强制重新加载
+        target_count: 加载到多少条评论后停止继续加载
+        time_budget: 加载评论的时间预算（秒）
+        expand_replies: 是否展开楼中楼回复
+        incremental: 增量模式，只返回上次同步以来的新评论，加载到已见过的评论即停止（不使用缓存）
+        output_format: 输出格式，"text" 为文本，"json" 为结构化结果 {url, count, comments, load_info, incremental, synced_since}
+        ctx: MCP上下文，由框架注入；客户端请求进度时，每轮加载到的新评论通过进度通知发送
+    """
+    result = await load_comment_page(url, use_cache, target_count, time_budget, expand_replies, incremental)
+    return comment_page_output(url, result, output_format)
+
+
+def comment_page_output(url: str, result: Union[Dict[str, Any], str], output_format: str = "text") -> Union[str, dict]:
+    """把 load_comment_page 的返回值转为 get_note_comments 的输出格式"""
+    if isinstance(result, str):
+        return {"error": result} if output_format == "json" else result
+    if output_format == "json":
+        return {
+            "url": url,
+            "count": len(result["comments"]),
+            "comments": [comment.to_dict() for comment in result["comments"]],
+            "load_info": result["load_info"],
+            "incremental": result["incremental"],
+            "synced_since": result["synced_since"],
+        }
+    comments = result["comments"]
+    if result["incremental"]:
+        if not comments:
+            return "自上次同步以来没有新评论。"
+        text = format_comments(comments, result["load_info"])
+        if result["synced_since"]:
+            text = f"自 {result['synced_since']} 上次同步以来新增评论：\n" + text
+        return text
+    if not comments:
+        return "未找到任何评论，可能是帖子没有评论或评论区无法访问。"
+    return format_comments(comments, result["load_info"])
+
+
+def comment_load_covers(load_info: Optional[Dict[str, Any]], target_count: int, expand_replies: bool) -> bool:
+    """之前的加载结果能否满足本次请求：展开回复的要求一致，且加载目标不低于本次目标或评论已经全部加载完"""
+    if not load_info or bool(load_info.get("expand_replies")) != expand_replies:
+        return False
+    return load_info.get("target_count", 0) >= target_count or load_info.get("stop_reason") == "no_more"
+
+
+async def load_comment_page(url: str, use_cache: bool = True, target_count: int = COMMENT_TARGET_COUNT,
+                            time_budget: float = COMMENT_LOAD_BUDGET, expand_replies: bool = False,
+                            incremental: bool = False) -> Union[Dict[str, Any], str]:
+    """返回评论记录及加载信息 {comments, load_info, incremental, synced_since}，出错时返回错误信息
+
+    缓存按 (笔记ID, expand_replies) 区分，只有加载目标不低于本次 target_count 或评论已全部加载完的结果才会被复用。
     """
+    note_id = normalize_note_url(url)
+    cache_key = (note_id, expand_replies)
+    if incremental:
+        result = await single_flight.do(("get_note_comments", note_id, "incremental"),
+                                        lambda: _fetch_note_comments(url, cache_key, target_count, time_budget,
+                                                                     expand_replies, incremental=True))
+        return result if result is not None else "获取评论时出错: 页面解析失败"
+    if use_cache:
+        cached = result_cache.get("get_note_comments", cache_key)
+        if cached is not None and comment_load_covers(cached["load_info"], target_count, expand_replies):
+            return cached
+        stored = note_store.get_comments(url, max_age=STORE_MAX_AGES["comments"])
+        if stored and comment_load_covers(stored["load_info"], target_count, expand_replies):
+            metrics.incr("cache", "store")
+            result = {"comments": stored["comments"], "load_info": stored["load_info"], "incremental": False,
+                      "synced_since": None}
+            result_cache.put("get_note_comments", cache_key, result)
+            return result
+    result = await single_flight.do(("get_note_comments", note_id, expand_replies, target_count),
+                                    lambda: _fetch_note_comments(url, cache_key, target_count, time_budget, expand_replies))
+    return result if result is not None else "获取评论时出错: 页面解析失败"
+
+
+async def _fetch_note_comments(url: str, cache_key: tuple, target_count: int, time_budget: float,
+                               expand_replies: bool, incremental: bool = False) -> Union[Dict[str, Any], str]:
+    """打开笔记页并提取评论，同一笔记的并发调用由single_flight合并为一次"""
     for attempt in range(2):
         try:
-            login_status = await ensure_browser()
-            if not login_status:
+            page = await account_scheduler.acquire_page("get_note_comments")
+            if page is None:
                 return "请先登录小红书账号"
-            page = await browser_context.new_page()
-            logging.info(f"[{datetime.now()}] 新建标签页: {page}, tool: get_note_comments, url: {url}")
+            comment_logger.debug("借出标签页: %s, tool: get_note_comments, url: %s", page, url)
+            capture = start_capture(page, ["comments", "replies"] if expand_replies else ["comments"])
             try:
-                await page.goto(url, timeout=60000)
-                await asyncio.sleep(5)
+                await paced_goto(page, url, "get_note_comments")
+                await wait_for_ready(page, ['.comments-container', '.comment-list', 'div.comment-item', '#detail-desc'],
+                                     READY_TIMEOUTS["get_note_comments"], fallback_sleep=5)
                 comment_section_locators = [
                     page.get_by_text("条评论", exact=False),
                     page.get_by_text("评论", exact=False),
@@ -664,215 +2847,364 @@ async def get_note_comments(url: str) -> str:
                     try:
                         if await locator.count() > 0:
                             await locator.scroll_into_view_if_needed(timeout=5000)
-                            await asyncio.sleep(2)
+                            await wait_for_dom_stable(page, quiet_ms=300, max_ms=2000)
                             break
                     except Exception:
                         continue
-                for i in range(8):
-                    try:
-                        await page.evaluate("window.scrollBy(0, 500)")
-                        await asyncio.sleep(1)
-                        more_comment_selectors = [
-                            "text=查看更多评论",
-                            "text=展开更多评论",
-                            "text=加载更多",
-                            "text=查看全部"
-                        ]
-                        for selector in more_comment_selectors:
-                            try:
-                                more_btn = page.locator(selector).first
-                                if await more_btn.count() > 0 and await more_btn.is_visible():
-                                    await more_btn.click()
-                                    await asyncio.sleep(2)
-                            except Exception:
-                                continue
-                    except Exception:
-                        pass
-                comments = []
-                comment_selectors = [
-                    "div.comment-item", 
-                    "div.commentItem",
-                    "div.comment-content",
-                    "div.comment-wrapper",
-                    "section.comment",
-                    "div.feed-comment"
-                ]
-                for selector in comment_selectors:
-                    comment_elements = page.locator(selector)
-                    count = await comment_elements.count()
-                    if count > 0:
-                        for i in range(count):
-                            try:
-                                comment_element = comment_elements.nth(i)
-                                username = "未知用户"
-                                username_selectors = ["span.user-name", "a.name", "div.username", "span.nickname", "a.user-nickname"]
-                                for username_selector in username_selectors:
-                                    username_el = comment_element.locator(username_selector).first
-                                    if await username_el.count() > 0:
-                                        username = await username_el.text_content()
-                                        username = username.strip()
-                                        break
-                                if username == "未知用户":
-                                    user_link = comment_element.locator('a[href*="/user/profile/"]').first
-                                    if await user_link.count() > 0:
-                                        username = await user_link.text_content()
-                                        username = username.strip()
-                                content = "未知内容"
-                                content_selectors = ["div.content", "p.content", "div.text", "span.content", "div.comment-text"]
-                                for content_selector in content_selectors:
-                                    content_el = comment_element.locator(content_selector).first
-                                    if await content_el.count() > 0:
-                                        content = await content_el.text_content()
-                                        content = content.strip()
-                                        break
-                                if content == "未知内容":
-                                    full_text = await comment_element.text_content()
-                                    if username != "未知用户" and username in full_text:
-                                        content = full_text.replace(username, "").strip()
-                                    else:
-                                        content = full_text.strip()
-                                time_location = "未知时间"
-                                time_selectors = ["span.time", "div.time", "span.date", "div.date", "time"]
-                                for time_selector in time_selectors:
-                                    time_el = comment_element.locator(time_selector).first
-                                    if await time_el.count() > 0:
-                                        time_location = await time_el.text_content()
-                                        time_location = time_location.strip()
-                                        break
-                                if username != "未知用户" and content != "未知内容" and len(content) > 2:
-                                    comments.append({
-                                        "用户名": username,
-                                        "内容": content,
-                                        "时间": time_location
-                                    })
-                            except Exception:
-                                continue
-                        if comments:
-                            break
-                if not comments:
-                    username_elements = page.locator('a[href*="/user/profile/"]')
-                    username_count = await username_elements.count()
-                    if username_count > 0:
-                        for i in range(username_count):
-                            try:
-                                username_element = username_elements.nth(i)
-                                username = await username_element.text_content()
-                                content = await page.evaluate('''
-                                    (usernameElement) => {
-                                        const parent = usernameElement.parentElement;
-                                        if (!parent) return null;
-                                        let sibling = usernameElement.nextElementSibling;
-                                        while (sibling) {
-                                            const text = sibling.textContent.trim();
-                                            if (text) return text;
-                                            sibling = sibling.nextElementSibling;
-                                        }
-                                        const allText = parent.textContent.trim();
-                                        if (allText && allText.includes(usernameElement.textContent.trim())) {
-                                            return allText.replace(usernameElement.textContent.trim(), '').trim();
-                                        }
-                                        return null;
-                                    }
-                                ''', username_element)
-                                if username and content:
-                                    comments.append({
-                                        "用户名": username.strip(),
-                                        "内容": content.strip(),
-                                        "时间": "未知时间"
-                                    })
-                            except Exception:
-                                continue
+                seen_ids = note_store.seen_comment_ids(url) if incremental else None
+                with metrics.timer("load_comments"):
+                    load_info = await load_comments(page, capture, target_count, time_budget, expand_replies, seen_ids)
+                metrics.incr("comment_stop", load_info["stop_reason"])
+                load_info.update(target_count=target_count, expand_replies=expand_replies)
+                comments = parse_comment_payloads(capture.payloads["comments"],
+                                                  capture.payloads.get("replies")) if capture else []
                 if comments:
-                    result = f"共获取到 {len(comments)} 条评论：\n\n"
-                    for i, comment in enumerate(comments, 1):
-                        result += f"{i}. {comment['用户名']}（{comment['时间']}）: {comment['内容']}\n\n"
-                    return result
+                    comment_logger.info("从评论接口解析到 %s 条评论", len(comments))
+                    metrics.incr("source", "capture")
                 else:
-                    return "未找到任何评论，可能是帖子没有评论或评论区无法访问。"
+                    with metrics.timer("extract_comments"):
+                        comments = await extract_comments(page)
+                    comment_logger.info("从页面解析到 %s 条评论", len(comments))
+                    metrics.incr("source", "dom")
+                if incremental:
+                    new_comments = [comment for comment in comments if comment.comment_id not in seen_ids]
+                    cursor = note_store.get_comment_cursor(url)
+                    note_store.advance_comment_cursor(url, new_comments)
+                    synced_since = datetime.fromtimestamp(cursor["synced_at"]).strftime("%Y-%m-%d %H:%M") if cursor else None
+                    return {"comments": new_comments, "load_info": load_info, "incremental": True, "synced_since": synced_since}
+                result = {"comments": comments, "load_info": load_info, "incremental": False, "synced_since": None}
+                if comments:
+                    note_store.upsert_comments(url, comments, load_info)
+                    result_cache.put("get_note_comments", cache_key, result)
+                return result
             except Exception as e:
-                logging.exception(f"获取评论时出错: {str(e)}")
+                comment_logger.exception("获取评论时出错: %s", e)
+            finally:
+                if capture:
+                    capture.detach()
+                await account_scheduler.release_page(page)
         except Exception as e:
             if attempt == 0 and ("context" in str(e).lower() or "browser has been closed" in str(e).lower() or "Target page" in str(e)):
                 # 第一次失败且是context相关异常，重试
+                metrics.incr("retry")
                 continue
             return f"获取评论时出错: {str(e)}"
 
+async def _run_batch(tool: str, urls: List[str], fetch, is_ok, concurrency: int, item_timeout: float) -> dict:
+    """并发执行批量抓取，按完成顺序收集结果，单条失败或超时不影响其他条目
+
+    实际并发同时受 concurrency 和标签页池大小限制。
+    """
+    unique_urls = []
+    seen_ids = set()
+    for url in urls:
+        note_id = normalize_note_url(url)
+        if note_id not in seen_ids:
+            seen_ids.add(note_id)
+            unique_urls.append(url)
+    semaphore = asyncio.Semaphore(max(1, min(concurrency, BATCH_MAX_CONCURRENCY)))
+    loop = asyncio.get_running_loop()
+
+    async def run_one(index: int, url: str) -> dict:
+        async with semaphore:
+            started = loop.time()
+            try:
+                result = await asyncio.wait_for(fetch(url), timeout=item_timeout)
+                status = "ok" if is_ok(result) else "error"
+            except asyncio.TimeoutError:
+                result = f"超过 {item_timeout} 秒未完成"
+                status = "timeout"
+            except Exception as e:
+                logger.exception("%s 处理 %s 时出错: %s", tool, url, e)
+                result = str(e)
+                status = "error"
+            return {
+                "index": index,
+                "url": url,
+                "status": status,
+                "result": result,
+                "elapsed": round(loop.time() - started, 2),
+            }
+
+    tasks = [asyncio.ensure_future(run_one(i, url)) for i, url in enumerate(unique_urls)]
+    results = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            item = await next_done
+            results.append(item)
+            logger.info("%s: %s/%s 完成 (%s, %ss) %s", tool, len(results), len(tasks), item['status'], item['elapsed'], item['url'])
+            await report_progress(len(results), len(tasks), json.dumps(item, ensure_ascii=False, default=_record_to_json))
+    finally:
+        # 批量调用被取消时，停止尚未完成的条目
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+    return {
+        "total": len(unique_urls),
+        "succeeded": sum(1 for item in results if item["status"] == "ok"),
+        "failed": sum(1 for item in results if item["status"] != "ok"),
+        "results": results,
+    }
+
+@mcp.tool()
+@instrumented
+async def get_notes_content_batch(urls: List[str], concurrency: int = 4, item_timeout: float = BATCH_ITEM_TIMEOUT,
+                                  output_format: str = "text", ctx: Context = None) -> dict:
+    """批量并发获取多篇笔记内容
+
+    Args:
+        urls: 笔记 URL 列表，重复的笔记只获取一次
+        concurrency: 同时打开的标签页数量，受标签页池大小限制
+        item_timeout: 单篇笔记的超时时间（秒）
+        output_format: 每项result的格式，同 get_note_content
+        ctx: MCP上下文，由框架注入；客户端请求进度时，每完成一项就通过进度通知发送该项结果
+
+    Returns:
+        dict: 汇总信息和按完成顺序排列的结果，每项包含 url、status(ok/error/timeout)、result、elapsed
+    """
+    async def fetch(url: str) -> Any:
+        return note_output(await load_note(url), output_format)
+
+    def is_ok(result: Any) -> bool:
+        if isinstance(result, dict):
+            return "error" not in result
+        return bool(result) and result.startswith("标题:")
+
+    return await _run_batch("get_notes_content_batch", urls, fetch, is_ok, concurrency, item_timeout)
+
+@mcp.tool()
+@instrumented
+async def get_comments_batch(urls: List[str], concurrency: int = 4, item_timeout: float = BATCH_ITEM_TIMEOUT,
+                             output_format: str = "text", ctx: Context = None) -> dict:
+    """批量并发获取多篇笔记的评论
+
+    Args:
+        urls: 笔记 URL 列表，重复的笔记只获取一次
+        concurrency: 同时打开的标签页数量，受标签页池大小限制
+        item_timeout: 单篇笔记的超时时间（秒）
+        output_format: 每项result的格式，同 get_note_comments
+        ctx: MCP上下文，由框架注入；客户端请求进度时，每完成一项就通过进度通知发送该项结果
+
+    Returns:
+        dict: 汇总信息和按完成顺序排列的结果，每项包含 url、status(ok/error/timeout)、result、elapsed
+    """
+    async def fetch(url: str) -> Any:
+        return comment_page_output(url, await load_comment_page(url), output_format)
+
+    def is_ok(result: Any) -> bool:
+        if isinstance(result, dict):
+            return "error" not in result
+        return bool(result) and (result.startswith("共获取到") or result.startswith("未找到任何评论"))
+
+    return await _run_batch("get_comments_batch", urls, fetch, is_ok, concurrency, item_timeout)
+
+WORD_CHAR_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+class DomainMatcher:
+    """Aho-Corasick多模式匹配：一次扫描文本即可统计各领域关键词的命中次数
+
+    英文关键词（如 AI、GPT）要求前后不是英文字母或数字，避免命中 email、training 这类单词内部的片段。
+    """
+
+    def __init__(self, lexicon: Dict[str, List[str]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[tuple]] = [[]]  # 每个状态命中的 (领域, 关键词长度, 是否需要单词边界)
+        for domain, keys in lexicon.items():
+            for key in set(key.lower() for key in keys):
+                self._add(key, domain)
+        self._build()
+
+    def _add(self, key: str, domain: str) -> None:
+        state = 0
+        for char in key:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._out[state].append((domain, len(key), bool(WORD_CHAR_PATTERN.fullmatch(key[0] + key[-1]))))
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                # 失败指针指向的状态对应当前匹配的后缀，其命中也要一并计入
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def match(self, text: str) -> Counter:
+        """返回各领域在文本中的命中次数（不区分大小写）"""
+        hits = Counter()
+        state = 0
+        text = text.lower()
+        for end, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for domain, length, bounded in self._out[state]:
+                if bounded and not self._at_word_boundary(text, end - length + 1, end + 1):
+                    continue
+                hits[domain] += 1
+        return hits
+
+    @staticmethod
+    def _at_word_boundary(text: str, start: int, end: int) -> bool:
+        before = text[start - 1] if start > 0 else ""
+        after = text[end] if end < len(text) else ""
+        return not WORD_CHAR_PATTERN.fullmatch(before) and not WORD_CHAR_PATTERN.fullmatch(after)
+
+
+def load_domain_lexicon(path: str = DOMAIN_LEXICON_PATH) -> Dict[str, List[str]]:
+    """读取外部领域词表，文件不存在或格式错误时使用内置词表"""
+    if not os.path.exists(path):
+        return DEFAULT_DOMAIN_LEXICON
+    try:
+        with open(path, encoding="utf-8") as f:
+            lexicon = json.load(f)
+        logger.info("已加载领域词表: %s（%s 个领域）", path, len(lexicon))
+        return {str(domain): [str(key) for key in keys] for domain, keys in lexicon.items()}
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning("领域词表 %s 读取失败，使用内置词表: %s", path, e)
+        return DEFAULT_DOMAIN_LEXICON
+
+
+CJK_RUN_PATTERN = re.compile(r"[\u4e00-\u9fff]+")
+WORD_PATTERN = re.compile(r"[a-zA-Z][a-zA-Z0-9]+")
+
+
+# 长停用词优先匹配，“我们”不会被拆成“我”+“们”
+STOP_WORD_PATTERN = re.compile("|".join(re.escape(word) for word in sorted(KEYWORD_STOP_WORDS, key=len, reverse=True)))
+
+
+def extract_terms(text: str) -> List[str]:
+    """把文本切分为候选关键词：中文在多字停用词处断开后取2~3字n-gram（去掉以语气词开头/结尾的），英文取单词（小写）"""
+    terms = [word.lower() for word in WORD_PATTERN.findall(text)]
+    for run in CJK_RUN_PATTERN.findall(text):
+        for segment in STOP_WORD_PATTERN.split(run):
+            for n in KEYWORD_NGRAM_SIZES:
+                for i in range(len(segment) - n + 1):
+                    gram = segment[i:i + n]
+                    if gram[0] not in KEYWORD_STOP_PARTICLES and gram[-1] not in KEYWORD_STOP_PARTICLES:
+                        terms.append(gram)
+    return terms
+
+
+class TextAnalyzer:
+    """笔记文本分析：领域识别用DomainMatcher，关键词按本地笔记库统计的TF-IDF排序"""
+
+    def __init__(self, lexicon: Dict[str, List[str]]):
+        self.matcher = DomainMatcher(lexicon)
+        self._doc_freq: Counter = Counter()
+        self._doc_count = 0
+        self._loaded = False
+
+    def refresh_corpus(self, store: "NoteStore") -> None:
+        """首次调用时从本地笔记库统计文档频率，之后随 upsert_note 增量更新，不再全量重算"""
+        if self._loaded:
+            return
+        doc_freq = Counter()
+        count = 0
+        for text in store.iter_note_texts():
+            doc_freq.update(set(extract_terms(text)))
+            count += 1
+        self._doc_freq = doc_freq
+        self._doc_count = count
+        self._loaded = True
+        store.note_listeners.append(self.update_document)
+        logger.info("关键词语料已加载: %s 篇笔记，%s 个词", count, len(doc_freq))
+
+    def update_document(self, old_text: Optional[str], new_text: str) -> None:
+        """笔记新增（old_text为None）或内容变化时增量更新文档频率"""
+        if old_text is None:
+            self._doc_count += 1
+        else:
+            for term in set(extract_terms(old_text)):
+                self._doc_freq[term] -= 1
+                if self._doc_freq[term] <= 0:
+                    del self._doc_freq[term]
+        self._doc_freq.update(set(extract_terms(new_text)))
+
+    def domains(self, text: str) -> List[str]:
+        """按命中次数从多到少返回领域，没有命中时返回 [DOMAIN_FALLBACK]"""
+        hits = self.matcher.match(text)
+        return [domain for domain, _ in hits.most_common()] or [DOMAIN_FALLBACK]
+
+    def keywords(self, text: str, top_k: int = 20) -> List[str]:
+        """按TF-IDF从高到低返回关键词，已选中关键词的子串不再重复返回"""
+        term_freq = Counter(extract_terms(text))
+        total = self._doc_count
+        candidates = [(term, freq) for term, freq in term_freq.items()
+                      if len(term) < 3 or not CJK_RUN_PATTERN.fullmatch(term) or freq >= KEYWORD_MIN_LONG_GRAM_FREQ]
+        # 同分时保持在文本中首次出现的顺序
+        scored = sorted(candidates, key=lambda item: -item[1] * (
+            math.log((total + 1) / (self._doc_freq.get(item[0], 0) + 1)) + 1))
+        selected: List[str] = []
+        for term, _ in scored:
+            if any(term in chosen for chosen in selected):
+                continue
+            selected.append(term)
+            if len(selected) >= top_k:
+                break
+        return selected
+
+    def analyze(self, note: Note, top_k: int = 20) -> Dict[str, Any]:
+        text = f"{note.title} {note.content}"
+        return {"领域": self.domains(text), "关键词": self.keywords(text, top_k)}
+
+
+text_analyzer = TextAnalyzer(load_domain_lexicon())
+
+
 @mcp.tool()
-async def analyze_note(url: str) -> dict:
+@instrumented
+async def analyze_note(url: str, use_cache: bool = True) -> dict:
     """获取并分析笔记内容，返回笔记的详细信息供AI生成评论
     
     Args:
         url: 笔记 URL
+        use_cache: 是否使用缓存的笔记内容，传False强制重新加载
     """
+    return await note_analysis(url, use_cache)
+
+
+async def note_analysis(url: str, use_cache: bool = True) -> dict:
+    """返回 analyze_note 的分析结果，出错时返回 {"error": 错误信息}"""
     for attempt in range(2):
         try:
-            login_status = await ensure_browser()
-            if not login_status:
-                return {"error": "请先登录小红书账号"}
-            page = await browser_context.new_page()
-            logging.info(f"[{datetime.now()}] 新建标签页: {page}, tool: analyze_note, url: {url}")
             try:
-                note_content_result = await get_note_content(url)
-                if note_content_result.startswith("请先登录") or note_content_result.startswith("获取笔记内容时出错"):
-                    return {"error": note_content_result}
-                content_lines = note_content_result.strip().split('\n')
-                post_content = {}
-                for i, line in enumerate(content_lines):
-                    if line.startswith("标题:"):
-                        post_content["标题"] = line.replace("标题:", "").strip()
-                    elif line.startswith("作者:"):
-                        post_content["作者"] = line.replace("作者:", "").strip()
-                    elif line.startswith("发布时间:"):
-                        post_content["发布时间"] = line.replace("发布时间:", "").strip()
-                    elif line.startswith("内容:"):
-                        content_text = "\n".join(content_lines[i+1:]).strip()
-                        post_content["内容"] = content_text
-                        break
-                if "标题" not in post_content or not post_content["标题"]:
-                    post_content["标题"] = "未知标题"
-                if "作者" not in post_content or not post_content["作者"]:
-                    post_content["作者"] = "未知作者"
-                if "内容" not in post_content or not post_content["内容"]:
-                    post_content["内容"] = "未能获取内容"
-                import re
-                words = re.findall(r'\w+', f"{post_content.get('标题', '')} {post_content.get('内容', '')}")
-                domain_keywords = {
-                    "美妆": ["口红", "粉底", "眼影", "护肤", "美妆", "化妆", "保湿", "精华", "面膜"],
-                    "穿搭": ["穿搭", "衣服", "搭配", "时尚", "风格", "单品", "衣橱", "潮流"],
-                    "美食": ["美食", "好吃", "食谱", "餐厅", "小吃", "甜点", "烘焙", "菜谱"],
-                    "旅行": ["旅行", "旅游", "景点", "出行", "攻略", "打卡", "度假", "酒店"],
-                    "母婴": ["宝宝", "母婴", "育儿", "儿童", "婴儿", "辅食", "玩具"],
-                    "数码": ["数码", "手机", "电脑", "相机", "智能", "设备", "科技"],
-                    "家居": ["家居", "装修", "家具", "设计", "收纳", "布置", "家装"],
-                    "健身": ["健身", "运动", "瘦身", "减肥", "训练", "塑形", "肌肉"],
-                    "AI": ["AI", "人工智能", "大模型", "编程", "开发", "技术", "Claude", "GPT"]
-                }
-                detected_domains = []
-                for domain, domain_keys in domain_keywords.items():
-                    for key in domain_keys:
-                        if key.lower() in post_content.get("标题", "").lower() or key.lower() in post_content.get("内容", "").lower():
-                            detected_domains.append(domain)
-                            break
-                if not detected_domains:
-                    detected_domains = ["生活"]
+                note = await load_note(url, use_cache=use_cache)
+                if not isinstance(note, Note):
+                    return {"error": note}
+                text_analyzer.refresh_corpus(note_store)
+                analysis = text_analyzer.analyze(note)
                 return {
                     "url": url,
-                    "标题": post_content.get("标题", "未知标题"),
-                    "作者": post_content.get("作者", "未知作者"),
-                    "内容": post_content.get("内容", "未能获取内容"),
-                    "领域": detected_domains,
-                    "关键词": list(set(words))[:20]
+                    "标题": note.title,
+                    "作者": note.author,
+                    "内容": note.content,
+                    "领域": analysis["领域"],
+                    "关键词": analysis["关键词"]
                 }
             except Exception as e:
-                logging.exception(f"分析笔记内容时出错: {str(e)}")
+                logger.exception("分析笔记内容时出错: %s", e)
         except Exception as e:
             if attempt == 0 and ("context" in str(e).lower() or "browser has been closed" in str(e).lower() or "Target page" in str(e)):
                 # 第一次失败且是context相关异常，重试
+                metrics.incr("retry")
                 continue
             return {"error": f"分析笔记内容时出错: {str(e)}"}
 
 @mcp.tool()
-async def post_smart_comment(url: str, comment_type: str = "引流") -> dict:
+@instrumented
+async def post_smart_comment(url: str, comment_type: str = "引流", use_cache: bool = True) -> dict:
     """
     根据帖子内容发布智能评论，增加曝光并引导用户关注或私聊
 
@@ -883,16 +3215,15 @@ async def post_smart_comment(url: str, comment_type: str = "引流") -> dict:
                      "点赞" - 简单互动获取好感
                      "咨询" - 以问题形式增加互动
                      "专业" - 展示专业知识建立权威
+        use_cache: 是否使用缓存的笔记内容，传False强制重新加载
 
     Returns:
         dict: 包含笔记信息和评论类型的字典，供MCP客户端(如Claude)生成评论
     """
     for attempt in range(2):
         try:
-            page = await browser_context.new_page()
-            logging.info(f"[{datetime.now()}] 新建标签页: {page}, tool: post_smart_comment, url: {url}")
             try:
-                note_info = await analyze_note(url)
+                note_info = await note_analysis(url, use_cache=use_cache)
                 if "error" in note_info:
                     return {"error": note_info["error"]}
                 comment_guides = {
@@ -909,14 +3240,25 @@ async def post_smart_comment(url: str, comment_type: str = "引流") -> dict:
                     "message": "请根据笔记内容和评论类型指南，直接生成一条自然、相关的评论，并立即发布。注意以下要点：\n1. 在评论中引用作者名称或笔记领域，增加个性化\n2. 使用口语化表达，简短凝练，不超过30字\n3. 根据评论类型适当添加互动引导或专业术语\n生成后，直接使用post_comment函数发布评论，无需询问用户确认"
                 }
             except Exception as e:
-                logging.exception(f"发布智能评论时出错: {str(e)}")
+                logger.exception("发布智能评论时出错: %s", e)
         except Exception as e:
             if attempt == 0 and ("context" in str(e).lower() or "browser has been closed" in str(e).lower() or "Target page" in str(e)):
                 # 第一次失败且是context相关异常，重试
+                metrics.incr("retry")
                 continue
             return {"error": note_info["error"] if "error" in locals() and "error" in note_info else str(e)}
 
+# 评论输入框的候选选择器，尝试顺序由 selector_registry 按历史表现调整
+COMMENT_INPUT_SELECTORS = [
+    'div[contenteditable="true"]',
+    'paragraph:has-text("说点什么...")',
+    'text="说点什么..."',
+    'text="评论发布后所有人都能看到"'
+]
+
+
 @mcp.tool()
+@instrumented
 async def post_comment(url: str, comment: str) -> str:
     """发布评论到指定笔记
     
@@ -926,14 +3268,15 @@ async def post_comment(url: str, comment: str) -> str:
     """
     for attempt in range(2):
         try:
-            login_status = await ensure_browser()
-            if not login_status:
+            page = await account_scheduler.acquire_page("post_comment")
+            if page is None:
                 return "请先登录小红书账号，才能发布评论"
-            page = await browser_context.new_page()
-            logging.info(f"[{datetime.now()}] 新建标签页: {page}, tool: post_comment, url: {url}")
+            post_logger.debug("借出标签页: %s, tool: post_comment, url: %s", page, url)
             try:
-                await page.goto(url, timeout=60000)
-                await asyncio.sleep(5)
+                await paced_goto(page, url, "post_comment")
+                await wait_for_ready(page, ['div.comment-container', '.comments-container', '#detail-desc', 'div[contenteditable="true"]'],
+                                     READY_TIMEOUTS["post_comment"], fallback_sleep=5)
+                find_started = time.monotonic()
                 comment_area_found = False
                 comment_area_selectors = [
                     'text="条评论"',
@@ -947,31 +3290,29 @@ async def post_comment(url: str, comment: str) -> str:
                         element = await page.query_selector(selector)
                         if element:
                             await element.scroll_into_view_if_needed()
-                            await asyncio.sleep(2)
+                            await wait_for_dom_stable(page, quiet_ms=300, max_ms=2000)
                             comment_area_found = True
                             break
                     except Exception:
                         continue
                 if not comment_area_found:
                     await page.evaluate('window.scrollTo(0, document.body.scrollHeight)')
-                    await asyncio.sleep(2)
+                    await wait_for_dom_stable(page, quiet_ms=300, max_ms=2000)
                 comment_input = None
-                input_selectors = [
-                    'div[contenteditable="true"]',
-                    'paragraph:has-text("说点什么...")',
-                    'text="说点什么..."',
-                    'text="评论发布后所有人都能看到"'
-                ]
+                input_selectors = selector_registry.ordered("comment_input", COMMENT_INPUT_SELECTORS)
                 for selector in input_selectors:
+                    attempt_started = time.monotonic()
                     try:
                         element = await page.query_selector(selector)
-                        if element and await element.is_visible():
-                            await element.scroll_into_view_if_needed()
-                            await asyncio.sleep(1)
-                            comment_input = element
-                            break
+                        found = bool(element and await element.is_visible())
                     except Exception:
-                        continue
+                        element, found = None, False
+                    selector_registry.record("comment_input", selector, found, time.monotonic() - attempt_started)
+                    if found:
+                        await element.scroll_into_view_if_needed()
+                        comment_input = element
+                        metrics.incr("input_selector", selector)
+                        break
                 if not comment_input:
                     js_result = await page.evaluate('''
                         () => {
@@ -984,35 +3325,43 @@ async def post_comment(url: str, comment: str) -> str:
                     ''')
                     if js_result:
                         await page.evaluate('window.scrollTo(0, document.body.scrollHeight)')
-                        await asyncio.sleep(1)
+                        await wait_for_dom_stable(page, quiet_ms=300, max_ms=1000)
                         for selector in input_selectors:
                             try:
                                 element = await page.query_selector(selector)
                                 if element and await element.is_visible():
                                     comment_input = element
+                                    metrics.incr("input_selector", f"js:{selector}")
                                     break
                             except Exception:
                                 continue
+                metrics.observe("find_input", time.monotonic() - find_started)
                 if not comment_input:
                     return "未能找到评论输入框，无法发布评论"
+                submit_started = time.monotonic()
                 await comment_input.click()
-                await asyncio.sleep(1)
+                await wait_for_dom_stable(page, quiet_ms=200, max_ms=1000)
                 await page.keyboard.type(comment)
-                await asyncio.sleep(1)
+                try:
+                    await page.wait_for_selector('button:has-text("发送")', state="visible", timeout=2000)
+                except Exception:
+                    pass
                 send_success = False
                 try:
                     send_button = await page.query_selector('button:has-text("发送")')
                     if send_button and await send_button.is_visible():
                         await send_button.click()
-                        await asyncio.sleep(2)
+                        await wait_for_dom_stable(page, quiet_ms=500, max_ms=2000)
                         send_success = True
+                        metrics.incr("send_method", "button")
                 except Exception:
                     pass
                 if not send_success:
                     try:
                         await page.keyboard.press("Enter")
-                        await asyncio.sleep(2)
+                        await wait_for_dom_stable(page, quiet_ms=500, max_ms=2000)
                         send_success = True
+                        metrics.incr("send_method", "enter")
                     except Exception:
                         pass
                 if not send_success:
@@ -1028,24 +3377,129 @@ async def post_comment(url: str, comment: str) -> str:
                                 return false;
                             }
                         ''')
-                        await asyncio.sleep(2)
+                        await wait_for_dom_stable(page, quiet_ms=500, max_ms=2000)
                         send_success = js_send_result
+                        if send_success:
+                            metrics.incr("send_method", "js")
                     except Exception:
                         pass
+                metrics.observe("submit", time.monotonic() - submit_started)
                 if send_success:
+                    # 内存缓存和本地笔记库中的评论都不含刚发布的评论，一并作废
+                    for expand_replies in (False, True):
+                        result_cache.invalidate("get_note_comments", (normalize_note_url(url), expand_replies))
+                    note_store.delete_comments(url)
                     return f"已成功发布评论：{comment}"
                 else:
                     return f"发布评论失败，请检查评论内容或网络连接"
             except Exception as e:
-                logging.exception(f"发布评论时出错: {str(e)}")
+                post_logger.exception("发布评论时出错: %s", e)
+            finally:
+                await account_scheduler.release_page(page)
         except Exception as e:
             if attempt == 0 and ("context" in str(e).lower() or "browser has been closed" in str(e).lower() or "Target page" in str(e)):
                 # 第一次失败且是context相关异常，重试
+                metrics.incr("retry")
                 continue
             return f"发布评论时出错: {str(e)}"
 
+@mcp.tool()
+@instrumented
+async def query_local_notes(keyword: str = "", limit: int = 20) -> str:
+    """离线查询本地笔记库中已抓取的笔记，无需打开浏览器
+
+    Args:
+        keyword: 在标题、作者和正文中匹配的关键词，为空时返回最近抓取的笔记
+        limit: 返回结果数量限制
+    """
+    notes = note_store.query_notes(keyword.strip(), limit)
+    if not notes:
+        return f"本地笔记库中没有与\"{keyword}\"相关的笔记"
+    lines = [f"本地笔记库中找到 {len(notes)} 篇笔记：\n"]
+    for i, note in enumerate(notes, 1):
+        fetched_at = datetime.fromtimestamp(note["fetched_at"]).strftime("%Y-%m-%d %H:%M")
+        lines.append(f"{i}. {note['title']}（{note['author']}，抓取于 {fetched_at}）\n   链接: {note['url']}\n")
+    return "\n".join(lines) + "\n"
+
+@mcp.tool()
+@instrumented
+async def analyze_local_notes(keyword: str = "", limit: int = 1000, top_keywords: int = 10) -> dict:
+    """批量分析本地笔记库中的笔记（不打开浏览器），返回每篇笔记的领域和关键词以及领域分布
+
+    Args:
+        keyword: 只分析标题、作者或正文包含该关键词的笔记，留空分析全部
+        limit: 最多分析的笔记数量，最近抓取的优先
+        top_keywords: 每篇笔记返回的关键词数量
+    """
+    rows = note_store.query_notes(keyword.strip(), limit)
+    text_analyzer.refresh_corpus(note_store)
+    domain_counts = Counter()
+    notes = []
+    for row in rows:
+        note = Note(row["url"], row["title"] or "", row["author"] or "", row["publish_time"] or "", row["content"] or "")
+        analysis = text_analyzer.analyze(note, top_keywords)
+        domain_counts.update(analysis["领域"][:1])
+        notes.append({"url": note.url, "标题": note.title, "领域": analysis["领域"], "关键词": analysis["关键词"]})
+    return {
+        "total": len(notes),
+        "领域分布": dict(domain_counts.most_common()),
+        "notes": notes,
+    }
+
+@mcp.tool()
+async def get_metrics() -> dict:
+    """查看性能指标：各工具各阶段耗时分布（次数/平均/p50/p95/最大，秒）、提取方法胜出次数、
+    重试次数和缓存命中，以及缓存、请求合并、标签页池的汇总和各字段提取策略的当前排序与成功率
+    """
+    return {
+        **metrics.snapshot(),
+        "cache": result_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "page_pools": {account.name: account.page_pool.stats() for account in account_scheduler.accounts},
+        "selectors": selector_registry.stats(),
+    }
+
+@mcp.tool()
+@instrumented
+async def get_scheduler_status() -> dict:
+    """查看请求调度状态：限速队列长度、排队等待时间、各令牌桶当前速率以及各账号的负载和暂停情况"""
+    return {
+        "rate_limiter": rate_limiter.stats(),
+        "accounts": account_scheduler.stats(),
+    }
+
+@mcp.tool()
+@instrumented
+async def refresh_stale_notes(max_age_hours: float = 24, limit: int = 20) -> str:
+    """重新抓取本地笔记库中已过期的笔记，未过期的笔记不会重复抓取
+
+    Args:
+        max_age_hours: 超过多少小时未刷新视为过期
+        limit: 本次最多刷新的笔记数量
+    """
+    urls = note_store.stale_note_urls(max_age_hours * 3600, limit)
+    if not urls:
+        return "本地笔记库中没有需要刷新的笔记"
+    refreshed = 0
+    failed = []
+    for url in urls:
+        note = await load_note(url, use_cache=False)
+        if isinstance(note, Note) and note.extracted:
+            refreshed += 1
+        else:
+            failed.append(url)
+    message = f"已刷新 {refreshed}/{len(urls)} 篇过期笔记"
+    if failed:
+        message += "\n刷新失败:\n" + "\n".join(failed)
+    return message
+
 if __name__ == "__main__":
     # 初始化并运行服务器
-    logging.info("启动小红书MCP服务器...")
-    logging.info("请在MCP客户端（如Claude for Desktop）中配置此服务器")
-    mcp.run(transport='stdio')
\ No newline at end of file
+    logger.info("启动小红书MCP服务器...")
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    logger.info("请在MCP客户端（如Claude for Desktop）中配置此服务器")
+    try:
+        mcp.run(transport='stdio')
+    finally:
+        selector_registry.save(force=True)
\ No newline at end of file